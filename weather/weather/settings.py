@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -23,9 +25,11 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'django-insecure-s44&-w)8x4phuew364r@q9qqkiy1^4c!l984$*h!!q07-=2-6s'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# DEBUG=0 в окружении выключает режим отладки. Только без него collectstatic-статика отдается
+# по именам с хэшем через StaticFilesMiddleware (см. docker-compose.yml)
+DEBUG = os.environ.get('DEBUG', '1').lower() in ('1', 'true', 'on')
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = os.environ.get('ALLOWED_HOSTS', 'localhost,127.0.0.1,[::1]').split(',')
 
 
 # Application definition
@@ -42,6 +46,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'weather_forecast.middleware.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -81,6 +86,31 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Кэш прогнозов и ограничитель частоты запросов хранятся здесь. Чтобы они были общими
+# для нескольких процессов, укажите общий бэкенд, например
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache CACHE_LOCATION=redis://127.0.0.1:6379
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+# Ограничение частоты исходящих запросов: rate запросов за period секунд,
+# max_wait - сколько секунд запрос может ждать в очереди свободного слота
+UPSTREAM_RATE_LIMITS = {
+    'api.open-meteo.com': {'rate': 10, 'period': 1, 'max_wait': 5},
+    'ru.wikipedia.org': {'rate': 5, 'period': 1, 'max_wait': 5},
+}
+
+# Точки ближе этого расстояния (км) получают один и тот же закэшированный прогноз,
+# 0 - только точное совпадение координат. Долю попаданий показывает /api/weather_cache_stats/
+WEATHER_SNAP_RADIUS_KM = 2
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -121,6 +151,19 @@ STATICFILES_DIRS = [
     BASE_DIR / "weather_forecast/static",
 ]
 
+# Сюда collectstatic собирает файлы с хэшем в имени и их сжатые варианты (.gz, .br),
+# откуда их отдает weather_forecast.middleware.StaticFilesMiddleware
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'weather_forecast.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -17,10 +17,16 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 
-from weather_forecast.views import home, city_search_count
+from weather_forecast.views import (home, home_stream, home_stream_async, city_search_count, rate_limit_stats,
+                                    weather_cache_stats, forecast_api)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', home, name='home'),
+    path('stream/', home_stream, name='home_stream'),
+    path('stream/async/', home_stream_async, name='home_stream_async'),
+    path('api/forecast/', forecast_api, name='forecast_api'),
     path('api/city_search_count/', city_search_count, name='city_search_count'),
+    path('api/rate_limit_stats/', rate_limit_stats, name='rate_limit_stats'),
+    path('api/weather_cache_stats/', weather_cache_stats, name='weather_cache_stats'),
 ]
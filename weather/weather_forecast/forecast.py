@@ -0,0 +1,228 @@
+""" Компактное представление почасового прогноза.
+    Значения всех параметров хранятся одним массивом float32 (параметр x час) вместе со временем начала
+    и шагом, вместо 7 словарей со 168 словарями внутри. Дни и часы отдаются ленивыми представлениями,
+    которые читаются как прежние словари: forecast.date, forecast.hourly_data, hourly_data.time,
+    hourly_data|get_item:key в шаблоне и forecast['hourly_data'][0]['temperature'] в коде
+"""
+
+import math
+import struct
+from collections.abc import Mapping, Sequence
+from datetime import datetime, timezone
+
+import numpy as np
+from babel.dates import format_date
+
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# Заголовок бинарного формата: сигнатура, версия, начало (unix-время), шаг в секундах,
+# количество параметров, количество часов, длина списка имен параметров в байтах
+HEADER = struct.Struct('<4sBqIHHI')
+MAGIC = b'FCST'
+VERSION = 1
+
+
+def rounded_list(values: np.ndarray) -> list:
+    """ Значения с округлением до десятых, NaN (нет данных у open-meteo) заменяется на None """
+
+    rounded = np.round(np.asarray(values, dtype=np.float64), 1)
+    return [None if math.isnan(value) else value for value in rounded.tolist()]
+
+
+class Forecast(Sequence):
+    """ Прогноз по дням: forecast[0] - представление первого дня """
+
+    __slots__ = ('start', 'interval', 'variables', 'values')
+
+    def __init__(self, start: int, interval: int, variables: list, values: np.ndarray):
+        self.start = int(start)
+        self.interval = int(interval)
+        self.variables = list(variables)
+        self.values = np.ascontiguousarray(values, dtype=np.float32).reshape(len(self.variables), -1)
+
+    @classmethod
+    def from_arrays(cls, start: int, interval: int, arrays: dict) -> 'Forecast':
+        """ Прогноз из словаря {параметр: массив значений по часам} """
+
+        return cls(start, interval, list(arrays), np.stack(list(arrays.values())))
+
+    @property
+    def hours(self) -> int:
+        return self.values.shape[1]
+
+    @property
+    def hours_per_day(self) -> int:
+        return SECONDS_PER_DAY // self.interval
+
+    @property
+    def end(self) -> int:
+        return self.start + self.hours * self.interval
+
+    def column(self, key: str) -> np.ndarray:
+        """ Значения параметра по всем часам (без копирования) """
+
+        return self.values[self.variables.index(key)]
+
+    def select(self, variables: list) -> 'Forecast':
+        """ Прогноз только с выбранными параметрами """
+
+        rows = [self.variables.index(key) for key in variables]
+        return Forecast(self.start, self.interval, variables, self.values[rows])
+
+    def for_date(self, date: str) -> 'Forecast | None':
+        """ Прогноз только за один день ГГГГ-ММ-ДД (срез массива) или None, если такого дня нет """
+
+        for day in self:
+            if day.date == date:
+                first = day.day * self.hours_per_day
+                return Forecast(self.start + day.day * SECONDS_PER_DAY, self.interval, self.variables,
+                                self.values[:, first:first + self.hours_per_day])
+        return None
+
+    def __len__(self) -> int:
+        return self.hours // self.hours_per_day
+
+    def __getitem__(self, day):
+        if isinstance(day, slice):
+            return [self[index] for index in range(len(self))[day]]
+        if day < 0:
+            day += len(self)
+        if not 0 <= day < len(self):
+            raise IndexError('Нет такого дня в прогнозе')
+        return DayView(self, day)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Forecast):
+            return NotImplemented
+        return (self.start == other.start and self.interval == other.interval
+                and self.variables == other.variables and np.array_equal(self.values, other.values, equal_nan=True))
+
+    def __repr__(self) -> str:
+        return f'Forecast(start={self.start}, interval={self.interval}, variables={self.variables}, hours={self.hours})'
+
+    def to_list(self) -> list:
+        """ Прежняя структура: список словарей по дням со словарями по часам (для JSON) """
+
+        return [{'date': day['date'], 'weekday': day['weekday'],
+                 'hourly_data': [dict(hour) for hour in day['hourly_data']]} for day in self]
+
+    def to_bytes(self) -> bytes:
+        """ Бинарное представление: заголовок, имена параметров и значения float32 как есть """
+
+        names = '\0'.join(self.variables).encode()
+        header = HEADER.pack(MAGIC, VERSION, self.start, self.interval, len(self.variables), self.hours, len(names))
+        return header + names + self.values.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Forecast':
+        """ Восстанавливает прогноз из to_bytes. Поднимает ValueError при неверном формате """
+
+        if len(data) < HEADER.size:
+            raise ValueError('Неверный формат прогноза')
+        magic, version, start, interval, variables_count, hours, names_length = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Неверный формат прогноза')
+
+        offset = HEADER.size + names_length
+        variables = data[HEADER.size:offset].decode().split('\0') if variables_count else []
+        values = np.frombuffer(data, dtype=np.float32, count=variables_count * hours, offset=offset)
+        return cls(start, interval, variables, values.reshape(variables_count, hours).copy())
+
+    def __reduce__(self):
+        # pickle (в том числе кэш Django) сохраняет компактное бинарное представление
+        return Forecast.from_bytes, (self.to_bytes(),)
+
+
+class DayView(Mapping):
+    """ День прогноза: ключи date, weekday, hourly_data """
+
+    __slots__ = ('forecast', 'day')
+    keys_list = ('date', 'weekday', 'hourly_data')
+
+    def __init__(self, forecast: Forecast, day: int):
+        self.forecast = forecast
+        self.day = day
+
+    @property
+    def start(self) -> datetime:
+        timestamp = self.forecast.start + self.day * SECONDS_PER_DAY
+        return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+    @property
+    def date(self) -> str:
+        return self.start.strftime('%Y-%m-%d')
+
+    @property
+    def weekday(self) -> str:
+        return format_date(self.start, format='EEEE', locale='ru')
+
+    @property
+    def hourly_data(self) -> 'HourlyView':
+        return HourlyView(self.forecast, self.day * self.forecast.hours_per_day, self.forecast.hours_per_day)
+
+    def __getitem__(self, key: str):
+        if key not in self.keys_list:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.keys_list)
+
+    def __len__(self) -> int:
+        return len(self.keys_list)
+
+
+class HourlyView(Sequence):
+    """ Часы одного дня """
+
+    __slots__ = ('forecast', 'first', 'count')
+
+    def __init__(self, forecast: Forecast, first: int, count: int):
+        self.forecast = forecast
+        self.first = first
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, hour):
+        if isinstance(hour, slice):
+            return [self[index] for index in range(self.count)[hour]]
+        if hour < 0:
+            hour += self.count
+        if not 0 <= hour < self.count:
+            raise IndexError('Нет такого часа в прогнозе')
+        return HourView(self.forecast, self.first + hour)
+
+
+class HourView(Mapping):
+    """ Час прогноза: ключ time и значения параметров, округленные до десятых, None - нет данных """
+
+    __slots__ = ('forecast', 'index')
+
+    def __init__(self, forecast: Forecast, index: int):
+        self.forecast = forecast
+        self.index = index
+
+    @property
+    def time(self) -> str:
+        timestamp = self.forecast.start + self.index * self.forecast.interval
+        return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime('%H:%M')
+
+    def __getitem__(self, key: str):
+        if key == 'time':
+            return self.time
+        try:
+            row = self.forecast.variables.index(key)
+        except ValueError:
+            raise KeyError(key)
+        value = float(self.forecast.values[row, self.index])
+        return None if math.isnan(value) else round(value, 1)
+
+    def __iter__(self):
+        yield 'time'
+        yield from self.forecast.variables
+
+    def __len__(self) -> int:
+        return len(self.forecast.variables) + 1
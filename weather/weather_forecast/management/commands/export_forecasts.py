@@ -0,0 +1,338 @@
+""" Выгрузка прогнозов по списку городов в NDJSON или Parquet для аналитики.
+    Координаты городов ищутся параллельно в ограниченном пуле потоков,
+    прогнозы запрашиваются у open-meteo пачками по несколько точек за один запрос.
+    Результат пишется по мере получения, обработанные города отмечаются в файле контрольной точки,
+    поэтому прерванную выгрузку можно продолжить повторным запуском
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from ...forecast import rounded_list
+from ...models import SearchHistory
+from ...ratelimit import get_rate_limiter, RateLimitExceeded
+from ...utils import parse_coordinates, fetch_forecasts_batch, parse_variables, WEATHER_VARIABLES
+
+
+def read_cities_file(path: Path):
+    """ Названия городов из файла, по одному в строке, без пустых строк и повторов """
+
+    seen = set()
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            city_name = line.strip()
+            if city_name and city_name not in seen:
+                seen.add(city_name)
+                yield city_name
+
+
+def read_top_cities(limit: int):
+    """ Самые популярные города из истории поиска """
+
+    city_counts = (SearchHistory.objects.values('city_name').annotate(count=Count('city_name'))
+                   .order_by('-count')[:limit])
+    for city_count in city_counts.iterator():
+        yield city_count['city_name']
+
+
+def batched(iterable, size: int):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Checkpoint:
+    """ Контрольная точка: по строке JSON на записанную пачку - ее города и размер файла результата после нее.
+        Строка пишется одним вызовом, поэтому прерывание может оборвать только последнюю строку,
+        при чтении она отбрасывается вместе со своей пачкой
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.done = set()
+        self.offset = None
+        self.file = None
+
+    def load(self) -> None:
+        """ Читает целые строки и обрезает файл после последней из них """
+
+        valid_length = 0
+        with open(self.path, 'rb') as file:
+            for line in file:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('Оборванная строка')
+                    entry = json.loads(line)
+                    cities, offset = entry['cities'], entry['offset']
+                except (ValueError, KeyError, TypeError):
+                    break
+                self.done.update(cities)
+                self.offset = offset
+                valid_length += len(line)
+        os.truncate(self.path, valid_length)
+
+    def open(self, append: bool) -> None:
+        self.file = open(self.path, 'a' if append else 'w', encoding='utf-8')
+
+    def write(self, cities: list, offset: int | None) -> None:
+        self.file.write(json.dumps({'cities': cities, 'offset': offset}, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def close(self) -> None:
+        if self.file:
+            self.file.close()
+
+
+class NdjsonWriter:
+    """ Одна строка JSON на город: координаты, начало, шаг и столбцы почасовых значений.
+        При продолжении файл сначала обрезается до размера из контрольной точки:
+        так удаляются оборванная строка и города, которые записаны, но не попали в контрольную точку
+    """
+
+    def __init__(self, path: Path, variables: list, offset: int | None):
+        self.variables = variables
+        if offset is None:
+            self.file = open(path, 'wb')
+        else:
+            os.truncate(path, offset)
+            self.file = open(path, 'ab')
+
+    def write(self, records: list) -> None:
+        for city_name, (latitude, longitude), forecast in records:
+            record = {
+                'city_name': city_name,
+                'latitude': latitude,
+                'longitude': longitude,
+                'time': forecast.start,
+                'interval': forecast.interval,
+                'hourly': {key: rounded_list(forecast.column(key)) for key in self.variables},
+            }
+            self.file.write((json.dumps(record, ensure_ascii=False) + '\n').encode())
+        self.file.flush()
+
+    def position(self) -> int:
+        """ Размер записанных данных в байтах """
+
+        return self.file.tell()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetWriter:
+    """ Каталог с набором Parquet-файлов: одна строка на город и час, каждая пачка городов - свой файл.
+        Parquet можно прочитать только после записи футера при закрытии файла, поэтому файл пачки
+        пишется под временным именем и переименовывается в part-NNNNN.parquet после закрытия.
+        В каталоге всегда только целые файлы, а прерванная запись оставляет временный файл,
+        который удаляется при следующем запуске
+    """
+
+    def __init__(self, path: Path, variables: list, append: bool):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise CommandError('Для формата parquet нужен пакет pyarrow: pip install pyarrow')
+        if path.exists() and not path.is_dir():
+            raise CommandError(f'Для формата parquet --output должен быть каталогом, {path} - файл')
+
+        self.pa = pyarrow
+        self.variables = variables
+        self.path = path
+        path.mkdir(parents=True, exist_ok=True)
+        for temporary in path.glob('.part-*.parquet.tmp'):
+            temporary.unlink()
+        if not append:
+            for part in self.parts():
+                part.unlink()
+        self.part_number = max((int(part.stem.removeprefix('part-')) for part in self.parts()), default=0)
+
+        fields = [('city_name', pyarrow.string()), ('latitude', pyarrow.float64()),
+                  ('longitude', pyarrow.float64()), ('time', pyarrow.timestamp('s', tz='UTC'))]
+        fields += [(key, pyarrow.float32()) for key in variables]
+        self.schema = pyarrow.schema(fields)
+
+    def parts(self) -> list:
+        return sorted(self.path.glob('part-*.parquet'))
+
+    def written_cities(self) -> set:
+        """ Города из уже записанных файлов, в том числе не успевшие попасть в контрольную точку """
+
+        cities = set()
+        for part in self.parts():
+            table = self.pa.parquet.read_table(part, columns=['city_name'])
+            cities.update(table.column('city_name').unique().to_pylist())
+        return cities
+
+    def write(self, records: list) -> None:
+        if not records:
+            return
+
+        columns = {name: [] for name in self.schema.names}
+        for city_name, (latitude, longitude), forecast in records:
+            hours = forecast.hours
+            columns['city_name'].append(np.full(hours, city_name, dtype=object))
+            columns['latitude'].append(np.full(hours, latitude))
+            columns['longitude'].append(np.full(hours, longitude))
+            columns['time'].append(forecast.start + np.arange(hours) * forecast.interval)
+            for key in self.variables:
+                columns[key].append(forecast.column(key))
+
+        arrays = [self.pa.array(np.concatenate(columns[field.name]), type=field.type) for field in self.schema]
+        self.part_number += 1
+        part = self.path / f'part-{self.part_number:05d}.parquet'
+        # Скрытое имя: читатели набора Parquet пропускают файлы, начинающиеся с точки
+        temporary = part.with_name(f'.{part.name}.tmp')
+        self.pa.parquet.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema), temporary)
+        # Переименование атомарно: файл с именем part-* всегда целый
+        temporary.replace(part)
+
+    def position(self) -> None:
+        """ Целостность файлов обеспечивает переименование после закрытия, размер не нужен """
+
+        return None
+
+    def close(self) -> None:
+        """ Файл каждой пачки закрывается сразу при записи """
+
+
+class Command(BaseCommand):
+    help = 'Выгружает прогнозы погоды на 7 дней по списку городов в NDJSON или Parquet'
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--input', type=Path, help='Файл с названиями городов, по одному в строке')
+        source.add_argument('--top', type=int, help='Взять N самых популярных городов из истории поиска')
+        parser.add_argument('--output', type=Path, required=True,
+                            help='Файл для результата, для формата parquet - каталог')
+        parser.add_argument('--format', choices=['ndjson', 'parquet'], default='ndjson')
+        parser.add_argument('--variables', nargs='+', choices=list(WEATHER_VARIABLES),
+                            help='Параметры погоды, по умолчанию все доступные')
+        parser.add_argument('--workers', type=int, default=8, help='Потоков для поиска координат')
+        parser.add_argument('--batch-size', type=int, default=50, help='Городов в одном запросе к open-meteo')
+        parser.add_argument('--checkpoint', type=Path,
+                            help='Файл контрольной точки, по умолчанию <output>.checkpoint')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers и --batch-size должны быть больше нуля')
+        # Пачка забирает по токену ограничителя на город, поэтому не должна превышать то,
+        # что ограничитель выдает за max_wait, иначе каждая пачка получит отказ
+        limiter = get_rate_limiter('api.open-meteo.com')
+        max_batch_size = int(limiter.rate * (1 + limiter.max_wait / limiter.period))
+        if options['batch_size'] > max_batch_size:
+            raise CommandError(f'--batch-size не может быть больше {max_batch_size} при текущем лимите запросов '
+                               f'к open-meteo (UPSTREAM_RATE_LIMITS)')
+
+        output = options['output']
+        checkpoint_path = options['checkpoint'] or output.with_name(output.name + '.checkpoint')
+        variables = parse_variables(options['variables']) if options['variables'] else list(WEATHER_VARIABLES)
+
+        # Контрольная точка имеет смысл, только пока существует файл с уже выгруженными данными
+        checkpoint = Checkpoint(checkpoint_path)
+        if checkpoint_path.exists() and output.exists():
+            checkpoint.load()
+        done = checkpoint.done
+        resume = bool(done)
+        if resume:
+            self.stdout.write(f'Продолжение выгрузки: уже обработано городов - {len(done)}')
+
+        if options['input']:
+            if not options['input'].exists():
+                raise CommandError(f'Файл {options["input"]} не найден')
+            cities = read_cities_file(options['input'])
+        else:
+            cities = read_top_cities(options['top'])
+
+        if options['format'] == 'parquet':
+            writer = ParquetWriter(output, variables, append=resume)
+            if resume:
+                done |= writer.written_cities()
+        else:
+            writer = NdjsonWriter(output, variables, offset=checkpoint.offset if resume else None)
+        cities = (city_name for city_name in cities if city_name not in done)
+
+        stats = {'exported': 0, 'not_found': 0, 'throttled': 0, 'failed': 0, 'batches': 0}
+        started = time.monotonic()
+        try:
+            checkpoint.open(append=resume)
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                batches = batched(cities, options['batch_size'])
+                # Координаты следующей пачки ищутся, пока запрашивается прогноз для текущей
+                pending = self.submit_geocoding(executor, next(batches, None))
+                while pending:
+                    current = pending
+                    pending = self.submit_geocoding(executor, next(batches, None))
+                    self.export_batch(current, writer, checkpoint, stats)
+                    self.write_progress(stats, started)
+        finally:
+            writer.close()
+            checkpoint.close()
+
+        elapsed = time.monotonic() - started
+        processed = stats['exported'] + stats['not_found'] + stats['throttled'] + stats['failed']
+        self.stdout.write(self.style.SUCCESS(
+            f'Выгружено городов: {stats["exported"]}, координаты не найдены: {stats["not_found"]}, '
+            f'отложены из-за лимита запросов: {stats["throttled"]}, '
+            f'ошибки прогноза: {stats["failed"]}, пачек запрошено: {stats["batches"]}. '
+            f'Время: {elapsed:.1f} с, {processed / elapsed if elapsed else 0:.1f} городов/с. Файл: {output}'
+        ))
+
+    @staticmethod
+    def submit_geocoding(executor, batch: list | None) -> list:
+        if not batch:
+            return []
+        return [(city_name, executor.submit(parse_coordinates, city_name)) for city_name in batch]
+
+    def export_batch(self, pending: list, writer, checkpoint: Checkpoint, stats: dict) -> None:
+        """ Прогнозы для пачки городов одним запросом к API и запись результата и контрольной точки """
+
+        located = []
+        for city_name, future in pending:
+            try:
+                coordinates = future.result()
+            except RateLimitExceeded:
+                # Город не попадает в контрольную точку и будет выгружен при повторном запуске
+                stats['throttled'] += 1
+                continue
+            if coordinates:
+                located.append((city_name, coordinates))
+            else:
+                stats['not_found'] += 1
+
+        if not located:
+            return
+
+        try:
+            forecasts = fetch_forecasts_batch([coordinates for _, coordinates in located])
+        except RateLimitExceeded:
+            self.stderr.write(f'Превышен лимит запросов к open-meteo, пачка из {len(located)} городов отложена')
+            stats['throttled'] += len(located)
+            return
+        except Exception as e:
+            self.stderr.write(f'Ошибка при получении погоды для пачки из {len(located)} городов: {e}')
+            stats['failed'] += len(located)
+            return
+        stats['batches'] += 1
+
+        writer.write([(city_name, coordinates, forecast)
+                      for (city_name, coordinates), forecast in zip(located, forecasts)])
+        # Город отмечается обработанным только после записи результата (для Parquet - после закрытия файла)
+        checkpoint.write([city_name for city_name, _ in located], writer.position())
+        stats['exported'] += len(located)
+
+    def write_progress(self, stats: dict, started: float) -> None:
+        if self.verbosity < 2:
+            return
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'Выгружено {stats["exported"]} городов за {elapsed:.1f} с '
+                          f'({stats["exported"] / elapsed if elapsed else 0:.1f} городов/с)')
@@ -0,0 +1,21 @@
+""" Счетчики метрик в кэше Django: общие для потоков, а при общем бэкенде кэша - и для процессов """
+
+from django.core.cache import cache
+
+
+def incr_counter(key: str, value: int = 1) -> None:
+    """ Атомарно увеличивает счетчик, создавая его при необходимости """
+
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key, value)
+    except ValueError:
+        # Ключ мог быть вытеснен из кэша между add и incr
+        cache.set(key, value, timeout=None)
+
+
+def get_counters(keys: dict) -> dict:
+    """ Значения счетчиков: {имя метрики: ключ в кэше} -> {имя метрики: значение} """
+
+    values = cache.get_many(list(keys.values()))
+    return {name: values.get(key, 0) for name, key in keys.items()}
@@ -0,0 +1,90 @@
+""" Раздача собранной статики из STATIC_ROOT без отдельного веб-сервера """
+
+import mimetypes
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.http import FileResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365  # 1 год, имя файла меняется вместе с содержимым
+DEFAULT_MAX_AGE = 60  # Файлы без хэша в имени могут поменяться при следующем деплое
+
+# Поддерживаемые кодировки в порядке предпочтения и расширения их файлов
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def parse_accept_encoding(header: str) -> set:
+    """ Возвращает кодировки из заголовка Accept-Encoding, которые клиент не запретил через q=0 """
+
+    accepted = set()
+    for item in header.split(','):
+        encoding, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if encoding and quality > 0:
+            accepted.add(encoding.strip().lower())
+    return accepted
+
+
+class StaticFilesMiddleware:
+    """ Отдает файлы из STATIC_ROOT.
+        Файлы с хэшем в имени кэшируются клиентом навсегда (immutable),
+        сжатый вариант выбирается по заголовку Accept-Encoding.
+        Если файл не найден, запрос передается дальше
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.static_url = '/' + settings.STATIC_URL.lstrip('/')
+        self.static_root = Path(settings.STATIC_ROOT).resolve() if settings.STATIC_ROOT else None
+
+    def __call__(self, request):
+        if (self.static_root is None or request.method not in ('GET', 'HEAD')
+                or not request.path.startswith(self.static_url)):
+            return self.get_response(request)
+
+        name = request.path[len(self.static_url):]
+        path = (self.static_root / name).resolve()
+        if not path.is_relative_to(self.static_root) or not path.is_file():
+            return self.get_response(request)
+
+        return self.serve(request, name, path)
+
+    def serve(self, request, name: str, path: Path) -> FileResponse:
+        accepted = parse_accept_encoding(request.headers.get('Accept-Encoding', ''))
+        variants = [(encoding, Path(str(path) + suffix)) for encoding, suffix in ENCODINGS]
+        variants = [(encoding, variant) for encoding, variant in variants if variant.is_file()]
+
+        file_path, content_encoding = path, None
+        for encoding, variant in variants:
+            if encoding in accepted:
+                file_path, content_encoding = variant, encoding
+                break
+
+        content_type, _ = mimetypes.guess_type(path.name)
+        response = FileResponse(open(file_path, 'rb'), content_type=content_type or 'application/octet-stream',
+                                filename=path.name)
+        if content_encoding:
+            response['Content-Encoding'] = content_encoding
+        if variants:
+            patch_vary_headers(response, ['Accept-Encoding'])
+
+        if self.is_hashed(name):
+            patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+        else:
+            patch_cache_control(response, public=True, max_age=DEFAULT_MAX_AGE)
+        return response
+
+    @staticmethod
+    def is_hashed(name: str) -> bool:
+        """ Имя файла с хэшем есть среди значений манифеста collectstatic """
+
+        return name in getattr(staticfiles_storage, 'hashed_files', {}).values()
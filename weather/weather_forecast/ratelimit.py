@@ -0,0 +1,147 @@
+""" Ограничение частоты исходящих запросов к внешним ресурсам (open-meteo, википедия).
+    Для каждого хоста работает GCRA - токен-бакет на rate токенов, который пополняется
+    равномерно по одному токену за period / rate секунд. Вместо количества токенов хранится
+    теоретическое время прибытия (TAT) - момент, к которому бакет снова станет полным.
+    TAT лежит в кэше Django целым числом микросекунд, поэтому бакет общий для всех потоков,
+    а при общем бэкенде кэша (Redis, Memcached) - и для всех процессов-воркеров.
+    Чтение и запись TAT выполняются под короткой блокировкой в том же кэше (cache.add):
+    после простоя TAT нужно подтянуть к текущему времени, а одним cache.incr это не сделать.
+    Каждый запрос резервирует свой интервал времени, поэтому ждущие в очереди получают слоты
+    по порядку и не просыпаются одновременно
+"""
+
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import incr_counter, get_counters
+
+
+# Лимиты по умолчанию, переопределяются настройкой UPSTREAM_RATE_LIMITS
+# rate - токенов за period секунд (и размер всплеска после простоя),
+# max_wait - сколько секунд запрос может ждать в очереди
+DEFAULT_RATE_LIMITS = {
+    'api.open-meteo.com': {'rate': 10, 'period': 1, 'max_wait': 5},
+    'ru.wikipedia.org': {'rate': 5, 'period': 1, 'max_wait': 5},
+}
+DEFAULT_RATE_LIMIT = {'rate': 5, 'period': 1, 'max_wait': 5}
+
+MICROSECONDS = 1_000_000
+# Блокировка держится только на время чтения и записи TAT. Срок жизни защищает от процесса,
+# упавшего с блокировкой: по его истечении ее заберет следующий запрос
+LOCK_TIMEOUT = 1
+LOCK_POLL_INTERVAL = 0.001
+
+
+class RateLimitExceeded(Exception):
+    """ Не удалось получить слот для запроса к внешнему ресурсу за отведенное время """
+
+
+class RateLimiter:
+    """ Токен-бакет (GCRA) для одного внешнего хоста """
+
+    def __init__(self, host: str, rate: int, period: float = 1, max_wait: float = 5):
+        self.host = host
+        self.rate = rate
+        self.period = period
+        self.max_wait = max_wait
+        self.key = f'ratelimit:tat:{host}'
+        self.lock_key = f'ratelimit:lock:{host}'
+        # Интервал между токенами и емкость бакета в микросекундах
+        self.interval = max(round(period * MICROSECONDS / rate), 1)
+        self.capacity = self.interval * rate
+
+    def _metric_key(self, name: str) -> str:
+        return f'ratelimit:metrics:{self.host}:{name}'
+
+    def _incr_metric(self, name: str, value: int = 1) -> None:
+        incr_counter(self._metric_key(name), value)
+
+    @staticmethod
+    def _now() -> int:
+        return round(time.time() * MICROSECONDS)
+
+    def _lock(self) -> None:
+        """ Ждет блокировку бакета не дольше LOCK_TIMEOUT, дальше она считается брошенной """
+
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while not cache.add(self.lock_key, 1, timeout=LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(LOCK_POLL_INTERVAL)
+
+    def _unlock(self) -> None:
+        cache.delete(self.lock_key)
+
+    def _reserve(self, tokens: int, max_wait: float) -> float | None:
+        """ Резервирует tokens токенов, если слот освободится не позже чем через max_wait секунд.
+            Возвращает время ожидания в секундах или None, если слот так далеко, что резерв не сделан
+        """
+
+        cost = tokens * self.interval
+        self._lock()
+        try:
+            now = self._now()
+            # После простоя резерв начинается с текущего момента, а не с момента в прошлом,
+            # иначе накопленный простой дал бы всплеск больше rate
+            tat = max(cache.get(self.key, now), now) + cost
+            # Слот свободен, когда после его резерва бакет не переполнен
+            wait = max(tat - now - self.capacity, 0) / MICROSECONDS
+            if wait > max_wait:
+                return None
+            # TAT хранится без срока жизни: ключей по одному на хост, а истечение ключа
+            # под нагрузкой обнулило бы бакет
+            cache.set(self.key, tat, timeout=None)
+            return wait
+        finally:
+            self._unlock()
+
+    def try_acquire(self, tokens: int = 1) -> bool:
+        """ Забирает tokens токенов, если они есть прямо сейчас. Не ждет """
+
+        if self._reserve(tokens, max_wait=0) is None:
+            return False
+        self._incr_metric('acquired', tokens)
+        return True
+
+    def acquire(self, tokens: int = 1) -> float:
+        """ Ждет tokens токенов не дольше max_wait секунд.
+            Запрос из нескольких точек к API должен забирать токен за каждую точку.
+            Возвращает время ожидания в секундах.
+            Поднимает RateLimitExceeded, если слот не освободится за max_wait
+        """
+
+        wait = self._reserve(tokens, self.max_wait)
+        if wait is None:
+            self._incr_metric('rejected')
+            logging.warning(f'Превышен лимит запросов к {self.host}')
+            raise RateLimitExceeded(f'Превышен лимит запросов к {self.host}')
+
+        if wait > 0:
+            self._incr_metric('queued')
+            self._incr_metric('queued_ms', round(wait * 1000))
+            time.sleep(wait)
+        self._incr_metric('acquired', tokens)
+        return wait
+
+    def get_metrics(self) -> dict:
+        """ Счетчики: выданные токены, запросы, ждавшие в очереди, суммарное ожидание и отказы """
+
+        names = ['acquired', 'queued', 'queued_ms', 'rejected']
+        return get_counters({name: self._metric_key(name) for name in names})
+
+
+def get_rate_limiter(host: str) -> RateLimiter:
+    """ Возвращает ограничитель для хоста с параметрами из настроек """
+
+    limits = getattr(settings, 'UPSTREAM_RATE_LIMITS', DEFAULT_RATE_LIMITS)
+    return RateLimiter(host, **limits.get(host, DEFAULT_RATE_LIMIT))
+
+
+def get_rate_limit_metrics() -> dict:
+    """ Метрики ограничителей для всех настроенных хостов """
+
+    limits = getattr(settings, 'UPSTREAM_RATE_LIMITS', DEFAULT_RATE_LIMITS)
+    return {host: get_rate_limiter(host).get_metrics() for host in limits}
@@ -0,0 +1,171 @@
+""" Пространственный индекс закэшированных прогнозов.
+    open-meteo отдает данные ячейки сетки модели, поэтому для точек в нескольких сотнях метров
+    друг от друга (районы, пригороды, разные названия города) прогноз одинаковый.
+    Координаты раскладываются по ячейкам регулярной сетки со стороной radius_km, в ячейке хранится
+    список точек, для которых прогноз положен в кэш, вместе со временем истечения прогноза.
+    Точки ищутся в ячейке запроса и восьми соседних, поэтому граница ячейки не мешает найти точку
+    в пределах radius_km. Прогноз может уйти из кэша раньше срока (вытеснение), поэтому поиск
+    возвращает всех кандидатов по возрастанию расстояния, а вызывающий берет первого, чей прогноз
+    еще в кэше, и удаляет из индекса остальных
+"""
+
+import math
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import incr_counter, get_counters
+
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+DEFAULT_SNAP_RADIUS_KM = 2
+# Блокировка ячейки на время ее перезаписи, как у ограничителя частоты
+LOCK_TIMEOUT = 1
+LOCK_POLL_INTERVAL = 0.001
+
+METRIC_KEYS = {
+    'exact_hits': 'weather:metrics:exact_hits',
+    'nearby_hits': 'weather:metrics:nearby_hits',
+    'misses': 'weather:metrics:misses',
+}
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """ Расстояние между двумя точками на поверхности Земли в километрах """
+
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class GridIndex:
+    """ Сетка ячеек в кэше Django. При radius_km <= 0 совпадают только точные координаты """
+
+    def __init__(self, radius_km: float, timeout: int, prefix: str = 'weather:grid'):
+        self.radius_km = radius_km
+        self.timeout = timeout
+        self.prefix = prefix
+        self.lat_step = radius_km / KM_PER_DEGREE if radius_km > 0 else 0
+
+    def _lon_step(self, row: int) -> float:
+        """ Ширина ячейки по долготе для строки сетки.
+            Берется по краю строки, ближнему к полюсу, где градус долготы короче всего,
+            чтобы ячейка везде была не уже radius_km
+        """
+
+        edge = max(abs(row * self.lat_step), abs((row + 1) * self.lat_step))
+        cos_edge = max(math.cos(math.radians(min(edge, 90))), 0.01)
+        return min(self.lat_step / cos_edge, 360)
+
+    def _cell_key(self, row: int, col: int) -> str:
+        return f'{self.prefix}:{self.radius_km}:{row}:{col}'
+
+    def _cell_keys(self, latitude: float, longitude: float) -> list:
+        """ Ключи ячейки точки и соседних с ней """
+
+        row = math.floor(latitude / self.lat_step)
+        keys = []
+        for neighbour_row in (row - 1, row, row + 1):
+            lon_step = self._lon_step(neighbour_row)
+            col = math.floor(longitude / lon_step)
+            keys.extend(self._cell_key(neighbour_row, neighbour_col) for neighbour_col in (col - 1, col, col + 1))
+        return keys
+
+    def _own_cell_key(self, latitude: float, longitude: float) -> str:
+        row = math.floor(latitude / self.lat_step)
+        return self._cell_key(row, math.floor(longitude / self._lon_step(row)))
+
+    @contextmanager
+    def _locked(self, key: str):
+        """ Блокировка ячейки через cache.add, чтобы одновременные записи не затирали друг друга """
+
+        lock_key = f'{key}:lock'
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while not cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            cache.delete(lock_key)
+
+    def find(self, latitude: float, longitude: float) -> list:
+        """ Известные точки не дальше radius_km, у которых не истек прогноз, от ближайшей к дальней.
+            При radius_km <= 0 - только сами координаты
+        """
+
+        if self.radius_km <= 0:
+            return [(latitude, longitude)]
+
+        now = time.time()
+        cells = cache.get_many(self._cell_keys(latitude, longitude))
+        candidates = []
+        for points in cells.values():
+            for point_latitude, point_longitude, expires in points:
+                distance = haversine_km(latitude, longitude, point_latitude, point_longitude)
+                if distance <= self.radius_km and expires > now:
+                    candidates.append((distance, (point_latitude, point_longitude)))
+        return [point for _, point in sorted(candidates)]
+
+    def add(self, latitude: float, longitude: float) -> None:
+        """ Запоминает точку, для которой прогноз положен в кэш на timeout секунд.
+            Заодно из ячейки удаляются точки с истекшим прогнозом: срок жизни ячейки
+            продлевается при каждом добавлении, и без этого они копились бы в ней
+        """
+
+        if self.radius_km <= 0:
+            return
+
+        now = time.time()
+        key = self._own_cell_key(latitude, longitude)
+        with self._locked(key):
+            points = [point for point in cache.get(key, [])
+                      if point[2] > now and (point[0], point[1]) != (latitude, longitude)]
+            cache.set(key, points + [(latitude, longitude, now + self.timeout)], self.timeout)
+
+    def discard(self, points: list) -> None:
+        """ Удаляет точки, прогноз которых уже не в кэше """
+
+        if self.radius_km <= 0:
+            return
+
+        cells = {}
+        for latitude, longitude in points:
+            cells.setdefault(self._own_cell_key(latitude, longitude), set()).add((latitude, longitude))
+        for key, dead in cells.items():
+            with self._locked(key):
+                remaining = [point for point in cache.get(key, []) if (point[0], point[1]) not in dead]
+                cache.set(key, remaining, self.timeout)
+
+
+def get_grid_index(timeout: int) -> GridIndex:
+    """ Индекс с радиусом из настройки WEATHER_SNAP_RADIUS_KM """
+
+    return GridIndex(getattr(settings, 'WEATHER_SNAP_RADIUS_KM', DEFAULT_SNAP_RADIUS_KM), timeout)
+
+
+def record_lookup(requested: tuple, found: tuple | None) -> None:
+    """ Учитывает результат поиска в кэше: точное совпадение, соседняя точка или промах """
+
+    if found is None:
+        incr_counter(METRIC_KEYS['misses'])
+    elif tuple(found) == tuple(requested):
+        incr_counter(METRIC_KEYS['exact_hits'])
+    else:
+        incr_counter(METRIC_KEYS['nearby_hits'])
+
+
+def get_snap_metrics() -> dict:
+    """ Счетчики попаданий в кэш прогнозов и доля попаданий для подбора радиуса """
+
+    metrics = get_counters(METRIC_KEYS)
+    total = sum(metrics.values())
+    metrics['hit_rate'] = round((metrics['exact_hits'] + metrics['nearby_hits']) / total, 4) if total else 0.0
+    metrics['radius_km'] = getattr(settings, 'WEATHER_SNAP_RADIUS_KM', DEFAULT_SNAP_RADIUS_KM)
+    return metrics
@@ -0,0 +1,51 @@
+""" Хранилище статики: имена файлов с хэшем содержимого (ManifestStaticFilesStorage)
+    и заранее сжатые gzip/brotli варианты, которые создаются при collectstatic
+"""
+
+import gzip
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, StaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ Рядом с каждым текстовым файлом сохраняет file.gz и file.br, если сжатие дает выигрыш """
+
+    # Без манифеста (тесты, запуск без collectstatic) отдаем ссылки на файлы без хэша
+    manifest_strict = False
+    compress_extensions = ('.css', '.js', '.svg', '.map', '.json', '.txt', '.html')
+
+    def url(self, name, force=False):
+        try:
+            return super().url(name, force)
+        except ValueError:
+            return StaticFilesStorage.url(self, name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+
+        if dry_run:
+            return
+        for name in set(self.hashed_files) | set(self.hashed_files.values()):
+            if name.endswith(self.compress_extensions) and self.exists(name):
+                self.compress(name)
+
+    def compress(self, name: str) -> None:
+        """ Сохраняет сжатые варианты файла, если они меньше исходного """
+
+        path = self.path(name)
+        with open(path, 'rb') as file:
+            content = file.read()
+
+        variants = [('.gz', gzip.compress(content, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress(content, quality=11)))
+
+        for suffix, compressed in variants:
+            if len(compressed) < len(content):
+                with open(path + suffix, 'wb') as file:
+                    file.write(compressed)
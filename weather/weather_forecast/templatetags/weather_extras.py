@@ -0,0 +1,14 @@
+from django import template
+
+
+register = template.Library()
+
+
+@register.filter
+def get_item(mapping, key):
+    """ Доступ к значению по ключу из переменной шаблона: {{ hourly_data|get_item:key }} """
+
+    try:
+        return mapping[key]
+    except (KeyError, IndexError, TypeError):
+        return ''
@@ -0,0 +1,214 @@
+import json
+import shutil
+import tempfile
+import unittest
+from io import StringIO
+from pathlib import Path
+
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+from unittest.mock import patch
+
+from ..models import User, SearchHistory
+from ..ratelimit import get_rate_limiter, RateLimitExceeded
+from ..utils import WEATHER_VARIABLES
+from .test_utils import make_openmeteo_response, patch_http_cache
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+COORDINATES = {
+    'Москва': (55.7558, 37.6173),
+    'Лондон': (51.5074, -0.1278),
+    'Париж': (48.8566, 2.3522),
+    'Токио': (35.6895, 139.6917),
+    'Рим': (41.9028, 12.4964),
+}
+
+
+def checkpoint_line(cities: list, offset: int | None) -> str:
+    return json.dumps({'cities': cities, 'offset': offset}, ensure_ascii=False) + '\n'
+
+
+def read_checkpoint(path: Path) -> list:
+    """ Города из контрольной точки в порядке записи """
+
+    lines = path.read_text(encoding='utf-8').splitlines()
+    return [city_name for line in lines for city_name in json.loads(line)['cities']]
+
+
+def fake_weather_api(url, params):
+    """ По одному ответу на каждую переданную точку """
+
+    return [make_openmeteo_response() for _ in params['latitude']]
+
+
+@patch('weather_forecast.utils.openmeteo_requests.Client')
+@patch('weather_forecast.management.commands.export_forecasts.parse_coordinates', side_effect=COORDINATES.get)
+class TestExportForecasts(TestCase):
+    def setUp(self):
+        cache.clear()
+        patch_http_cache(self)
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cities_file = self.directory / 'cities.txt'
+        self.cities_file.write_text('Москва\nЛондон\n\nПариж\nМосква\nНетакогогорода\nТокио\nРим\n', encoding='utf-8')
+        self.output = self.directory / 'forecasts.ndjson'
+
+    def export(self, *args):
+        stdout = StringIO()
+        call_command('export_forecasts', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_export_ndjson(self, _, mock_client):
+        """ Города выгружаются пачками, неизвестный город пропускается """
+
+        mock_client.return_value.weather_api.side_effect = fake_weather_api
+
+        stdout = self.export('--input', str(self.cities_file), '--output', str(self.output),
+                             '--batch-size', '2', '--variables', 'temperature', 'pressure')
+
+        records = [json.loads(line) for line in self.output.read_text(encoding='utf-8').splitlines()]
+        self.assertEqual([record['city_name'] for record in records], ['Москва', 'Лондон', 'Париж', 'Токио', 'Рим'])
+        self.assertEqual(set(records[0]['hourly']), {'temperature', 'pressure'})
+        self.assertEqual(len(records[0]['hourly']['temperature']), 168)
+        self.assertEqual(records[0]['latitude'], 55.7558)
+        # 6 городов пачками по 2, в одной из пачек только город с координатами
+        self.assertEqual(mock_client.return_value.weather_api.call_count, 3)
+        self.assertEqual(len(mock_client.return_value.weather_api.call_args_list[0].kwargs['params']['latitude']), 2)
+        self.assertIn('Выгружено городов: 5', stdout)
+        self.assertIn('координаты не найдены: 1', stdout)
+        # Токен ограничителя забирается за каждую точку, а не за запрос
+        self.assertEqual(get_rate_limiter('api.open-meteo.com').get_metrics()['acquired'], 5)
+
+    def test_resume_from_checkpoint(self, _, mock_client):
+        """ Повторный запуск выгружает только необработанные города и дописывает результат """
+
+        mock_client.return_value.weather_api.side_effect = fake_weather_api
+        first_lines = json.dumps({'city_name': 'Москва'}) + '\n' + json.dumps({'city_name': 'Лондон'}) + '\n'
+        self.output.write_text(first_lines, encoding='utf-8')
+        checkpoint = self.directory / 'forecasts.ndjson.checkpoint'
+        checkpoint.write_text(checkpoint_line(['Москва', 'Лондон'], len(first_lines.encode())), encoding='utf-8')
+
+        self.export('--input', str(self.cities_file), '--output', str(self.output))
+
+        lines = self.output.read_text(encoding='utf-8').splitlines()
+        self.assertEqual([json.loads(line)['city_name'] for line in lines],
+                         ['Москва', 'Лондон', 'Париж', 'Токио', 'Рим'])
+        self.assertEqual(read_checkpoint(checkpoint), ['Москва', 'Лондон', 'Париж', 'Токио', 'Рим'])
+
+    def test_resume_after_interrupted_write(self, _, mock_client):
+        """ Оборванная последняя строка и города, не попавшие в контрольную точку, при продолжении удаляются """
+
+        mock_client.return_value.weather_api.side_effect = fake_weather_api
+        moscow = json.dumps({'city_name': 'Москва'}, ensure_ascii=False) + '\n'
+        london = json.dumps({'city_name': 'Лондон', 'latitude': 51.5074}, ensure_ascii=False) + '\n'
+        # Пачка с Лондоном записана не до конца и не попала в контрольную точку,
+        # строка контрольной точки для следующей пачки тоже оборвана
+        self.output.write_text(moscow + london[:30], encoding='utf-8')
+        checkpoint = self.directory / 'forecasts.ndjson.checkpoint'
+        checkpoint.write_text(checkpoint_line(['Москва'], len(moscow.encode())) + '{"cities": ["Лон',
+                              encoding='utf-8')
+
+        self.export('--input', str(self.cities_file), '--output', str(self.output))
+
+        lines = self.output.read_text(encoding='utf-8').splitlines()
+        self.assertEqual([json.loads(line)['city_name'] for line in lines],
+                         ['Москва', 'Лондон', 'Париж', 'Токио', 'Рим'])
+        self.assertEqual(read_checkpoint(checkpoint), ['Москва', 'Лондон', 'Париж', 'Токио', 'Рим'])
+
+    def test_throttled_cities_not_checkpointed(self, mock_parse_coordinates, mock_client):
+        """ Город, для которого не хватило лимита запросов, не считается ненайденным и выгружается при повторном запуске """
+
+        def parse_coordinates(city_name):
+            if city_name == 'Париж':
+                raise RateLimitExceeded('Симуляция лимита')
+            return COORDINATES.get(city_name)
+
+        mock_client.return_value.weather_api.side_effect = fake_weather_api
+        mock_parse_coordinates.side_effect = parse_coordinates
+        checkpoint = self.directory / 'forecasts.ndjson.checkpoint'
+
+        stdout = self.export('--input', str(self.cities_file), '--output', str(self.output))
+
+        self.assertIn('координаты не найдены: 1', stdout)
+        self.assertIn('отложены из-за лимита запросов: 1', stdout)
+        self.assertNotIn('Париж', read_checkpoint(checkpoint))
+
+        mock_parse_coordinates.side_effect = COORDINATES.get
+        self.export('--input', str(self.cities_file), '--output', str(self.output))
+
+        lines = self.output.read_text(encoding='utf-8').splitlines()
+        self.assertEqual([json.loads(line)['city_name'] for line in lines][-1], 'Париж')
+
+    def test_batch_size_limited_by_rate_limit(self, *_):
+        """ Пачка, на которую ограничитель никогда не выдаст токенов, отклоняется сразу """
+
+        with self.assertRaises(CommandError):
+            self.export('--input', str(self.cities_file), '--output', str(self.output), '--batch-size', '1000')
+
+    def test_top_cities_from_history(self, _, mock_client):
+        """ Города берутся из истории поиска по популярности """
+
+        mock_client.return_value.weather_api.side_effect = fake_weather_api
+        user = User.objects.create()
+        for city_name in ['Рим', 'Рим', 'Токио', 'Рим', 'Токио', 'Париж']:
+            SearchHistory.objects.create(user=user, city_name=city_name)
+
+        self.export('--top', '2', '--output', str(self.output))
+
+        lines = self.output.read_text(encoding='utf-8').splitlines()
+        self.assertEqual([json.loads(line)['city_name'] for line in lines], ['Рим', 'Токио'])
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow не установлен')
+    def test_export_parquet(self, _, mock_client):
+        """ В Parquet одна строка на город и час """
+
+        mock_client.return_value.weather_api.side_effect = fake_weather_api
+        output = self.directory / 'forecasts.parquet'
+
+        self.export('--input', str(self.cities_file), '--output', str(output), '--format', 'parquet')
+
+        table = pyarrow.parquet.read_table(output)
+        self.assertEqual(table.num_rows, 5 * 168)
+        self.assertEqual(table.column_names[:4], ['city_name', 'latitude', 'longitude', 'time'])
+        self.assertEqual(table.column_names[4:], list(WEATHER_VARIABLES))
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow не установлен')
+    def test_parquet_resume_after_interrupt(self, _, mock_client):
+        """ После прерывания в каталоге только читаемые файлы, продолжение не теряет и не дублирует города """
+
+        calls = []
+
+        def interrupted_weather_api(url, params):
+            calls.append(params)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return fake_weather_api(url, params)
+
+        mock_client.return_value.weather_api.side_effect = interrupted_weather_api
+        output = self.directory / 'forecasts.parquet'
+        args = ['--input', str(self.cities_file), '--output', str(output), '--format', 'parquet', '--batch-size', '2']
+
+        with self.assertRaises(KeyboardInterrupt):
+            self.export(*args)
+        (output / '.part-00002.parquet.tmp').write_bytes(b'PAR1')
+
+        self.assertEqual(pyarrow.parquet.read_table(output).column('city_name').to_pylist()[::168],
+                         ['Москва', 'Лондон'])
+        checkpoint = self.directory / 'forecasts.parquet.checkpoint'
+        self.assertEqual(read_checkpoint(checkpoint), ['Москва', 'Лондон'])
+        # Прерывание между записью файла и контрольной точки: города берутся из самих файлов
+        checkpoint.write_text(checkpoint_line(['Москва'], None), encoding='utf-8')
+
+        mock_client.return_value.weather_api.side_effect = fake_weather_api
+        self.export(*args)
+
+        self.assertEqual(sorted(path.name for path in output.iterdir()),
+                         ['part-00001.parquet', 'part-00002.parquet', 'part-00003.parquet'])
+        cities = pyarrow.parquet.read_table(output).column('city_name').to_pylist()
+        self.assertEqual(sorted(cities[::168]), sorted(COORDINATES))
@@ -0,0 +1,113 @@
+import json
+import pickle
+import unittest
+
+import numpy as np
+from django.template import Context, Template
+
+from ..forecast import Forecast
+
+
+def make_forecast(hours: int = 168) -> Forecast:
+    """ Прогноз с 1 января 2025 00:00 UTC: температура равна номеру часа, влажность - 50 + номер часа """
+
+    return Forecast.from_arrays(1735689600, 3600, {
+        'temperature': np.arange(hours, dtype=np.float32) + 0.25,
+        'humidity': np.arange(hours, dtype=np.float32) + 50,
+    })
+
+
+class TestForecast(unittest.TestCase):
+    def test_days_and_hours(self):
+        """ Дни и часы читаются как прежние словари """
+
+        forecast = make_forecast()
+
+        self.assertEqual(len(forecast), 7)
+        self.assertEqual(forecast[0]['date'], '2025-01-01')
+        self.assertEqual(forecast[0]['weekday'], 'среда')
+        self.assertEqual(forecast[-1]['date'], '2025-01-07')
+        self.assertEqual(len(forecast[1]['hourly_data']), 24)
+        hour = forecast[1]['hourly_data'][2]
+        self.assertEqual(dict(hour), {'time': '02:00', 'temperature': 26.2, 'humidity': 76.0})
+        with self.assertRaises(KeyError):
+            hour['pressure']
+        with self.assertRaises(IndexError):
+            forecast[7]
+
+    def test_select(self):
+        """ select оставляет только выбранные параметры в заданном порядке """
+
+        forecast = make_forecast().select(['humidity'])
+
+        self.assertEqual(forecast.variables, ['humidity'])
+        self.assertEqual(list(forecast[0]['hourly_data'][0]), ['time', 'humidity'])
+        self.assertEqual(forecast.column('humidity')[0], 50)
+
+    def test_for_date(self):
+        """ Прогноз за один день - срез часов этого дня """
+
+        day = make_forecast().for_date('2025-01-03')
+
+        self.assertEqual(len(day), 1)
+        self.assertEqual(day[0]['date'], '2025-01-03')
+        self.assertEqual(day[0]['hourly_data'][0]['temperature'], 48.2)
+        self.assertIsNone(make_forecast().for_date('2025-02-01'))
+
+    def test_to_list(self):
+        """ to_list возвращает прежнюю структуру из словарей """
+
+        days = make_forecast().to_list()
+
+        self.assertEqual(len(days), 7)
+        self.assertEqual(days[0]['hourly_data'][0], {'time': '00:00', 'temperature': 0.2, 'humidity': 50.0})
+        self.assertIsInstance(days[0]['hourly_data'][0], dict)
+
+    def test_missing_values(self):
+        """ NaN от open-meteo отдается как None и не портит JSON """
+
+        forecast = make_forecast()
+        forecast.values[0, 1] = np.nan
+
+        self.assertIsNone(forecast[0]['hourly_data'][1]['temperature'])
+        days = forecast.to_list()
+        self.assertEqual(days[0]['hourly_data'][1], {'time': '01:00', 'temperature': None, 'humidity': 51.0})
+        json.dumps(days, allow_nan=False)
+
+    def test_template_access(self):
+        """ Шаблон обращается к прогнозу так же, как к списку словарей """
+
+        template = Template('{% load weather_extras %}{% for forecast in forecasts %}{% if forloop.first %}'
+                            '{{ forecast.date }} {{ forecast.weekday }}:{% for hour in forecast.hourly_data %}'
+                            '{% if forloop.counter < 3 %} {{ hour.time }}={{ hour|get_item:"humidity" }}{% endif %}'
+                            '{% endfor %}{% endif %}{% endfor %}')
+
+        rendered = template.render(Context({'forecasts': make_forecast()}))
+
+        self.assertEqual(rendered, '2025-01-01 среда: 00:00=50.0 01:00=51.0')
+
+    def test_binary_roundtrip(self):
+        """ to_bytes/from_bytes и pickle восстанавливают прогноз без потерь """
+
+        forecast = make_forecast()
+        forecast.values[0, 5] = np.nan
+
+        self.assertEqual(Forecast.from_bytes(forecast.to_bytes()), forecast)
+        self.assertEqual(pickle.loads(pickle.dumps(forecast)), forecast)
+        self.assertLess(len(pickle.dumps(forecast)), len(pickle.dumps(forecast.to_list())) / 2)
+
+    def test_from_bytes_invalid(self):
+        """ Неверные данные поднимают ValueError """
+
+        with self.assertRaises(ValueError):
+            Forecast.from_bytes(b'not a forecast')
+        with self.assertRaises(ValueError):
+            Forecast.from_bytes(b'')
+
+    def test_slots(self):
+        """ У прогноза и представлений нет __dict__ """
+
+        forecast = make_forecast()
+
+        for obj in (forecast, forecast[0], forecast[0]['hourly_data'], forecast[0]['hourly_data'][0]):
+            self.assertFalse(hasattr(obj, '__dict__'))
@@ -0,0 +1,158 @@
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.test import override_settings
+from unittest.mock import patch
+
+from ..ratelimit import RateLimiter, RateLimitExceeded, get_rate_limiter, MICROSECONDS
+
+
+class SlowCache:
+    """ Кэш, который делает паузу вокруг каждой операции, чтобы запросы из разных потоков
+        гарантированно перемежались между чтением и записью
+    """
+
+    sleep = time.sleep
+
+    def __getattr__(self, name):
+        method = getattr(cache, name)
+
+        def slow(*args, **kwargs):
+            SlowCache.sleep(0.005)
+            result = method(*args, **kwargs)
+            SlowCache.sleep(0.005)
+            return result
+        return slow
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @patch('weather_forecast.ratelimit.time.time', return_value=1000.0)
+    def test_try_acquire_within_rate(self, _):
+        """ Полный бакет выдает не больше rate токенов подряд """
+
+        limiter = RateLimiter('example.com', rate=3, period=1)
+
+        self.assertEqual([limiter.try_acquire() for _ in range(4)], [True, True, True, False])
+
+    def test_shared_between_instances(self):
+        """ Разные экземпляры для одного хоста расходуют один бакет через кэш """
+
+        with patch('weather_forecast.ratelimit.time.time', return_value=1000.0):
+            self.assertTrue(RateLimiter('example.com', rate=1).try_acquire())
+            self.assertFalse(RateLimiter('example.com', rate=1).try_acquire())
+            self.assertTrue(RateLimiter('other.com', rate=1).try_acquire())
+
+    def test_bucket_refills_evenly(self):
+        """ Токены возвращаются по одному за period / rate, а не все сразу на границе окна """
+
+        limiter = RateLimiter('example.com', rate=2, period=1)
+        with patch('weather_forecast.ratelimit.time.time', return_value=1000.0):
+            self.assertEqual([limiter.try_acquire() for _ in range(3)], [True, True, False])
+        with patch('weather_forecast.ratelimit.time.time', return_value=1000.5):
+            self.assertEqual([limiter.try_acquire() for _ in range(2)], [True, False])
+
+    def test_no_double_burst_after_idle(self):
+        """ После простоя доступно не больше rate токенов, простой не накапливается """
+
+        limiter = RateLimiter('example.com', rate=2, period=1)
+        with patch('weather_forecast.ratelimit.time.time', return_value=1000.9):
+            self.assertEqual([limiter.try_acquire() for _ in range(2)], [True, True])
+        with patch('weather_forecast.ratelimit.time.time', return_value=1001.0):
+            self.assertFalse(limiter.try_acquire())
+        with patch('weather_forecast.ratelimit.time.time', return_value=1100.0):
+            self.assertEqual([limiter.try_acquire() for _ in range(3)], [True, True, False])
+
+    def test_reservations_after_idle(self):
+        """ После простоя TAT подтягивается к текущему времени один раз, а не на каждый запрос """
+
+        limiter = RateLimiter('example.com', rate=5, period=1)
+        with patch('weather_forecast.ratelimit.time.time', return_value=1000.0):
+            limiter.try_acquire()
+        with patch('weather_forecast.ratelimit.time.time', return_value=4600.0):
+            self.assertTrue(limiter.try_acquire())
+            self.assertTrue(limiter.try_acquire())
+
+        self.assertEqual(cache.get(limiter.key), 4600 * MICROSECONDS + 2 * limiter.interval)
+
+    @patch('weather_forecast.ratelimit.cache', SlowCache())
+    @patch('weather_forecast.ratelimit.time.sleep')
+    @patch('weather_forecast.ratelimit.time.time', return_value=4600.0)
+    def test_concurrent_reservations_after_idle(self, *_):
+        """ Одновременные запросы после простоя не превышают всплеск rate и не уводят TAT в будущее """
+
+        limiter = RateLimiter('example.com', rate=5, period=1, max_wait=10)
+        cache.set(limiter.key, 1000 * MICROSECONDS, timeout=None)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            waits = list(executor.map(lambda _: RateLimiter('example.com', rate=5, max_wait=10).acquire(), range(8)))
+
+        self.assertEqual(sorted(waits), [0.0] * 5 + [0.2, 0.4, 0.6])
+        self.assertLessEqual(cache.get(limiter.key), 4600 * MICROSECONDS + 8 * limiter.interval)
+        # Бакет не заблокирован: следующий запрос ждет свою очередь, а не получает отказ
+        self.assertEqual(limiter.acquire(), 0.8)
+
+    @patch('weather_forecast.ratelimit.time.time', return_value=1000.0)
+    def test_acquire_several_tokens(self, _):
+        """ Запрос на несколько точек забирает токен за каждую """
+
+        limiter = RateLimiter('example.com', rate=5, period=1)
+
+        self.assertTrue(limiter.try_acquire(tokens=4))
+        self.assertFalse(limiter.try_acquire(tokens=2))
+        self.assertTrue(limiter.try_acquire())
+        self.assertEqual(limiter.get_metrics()['acquired'], 5)
+
+    @patch('weather_forecast.ratelimit.time.time', return_value=1000.0)
+    def test_acquire_rejected_after_max_wait(self, _):
+        """ Если слот не освободится за max_wait, поднимается RateLimitExceeded и резерв возвращается """
+
+        limiter = RateLimiter('example.com', rate=1, period=1, max_wait=0)
+        limiter.acquire()
+
+        with self.assertRaises(RateLimitExceeded):
+            limiter.acquire()
+        self.assertEqual(limiter.get_metrics(), {'acquired': 1, 'queued': 0, 'queued_ms': 0, 'rejected': 1})
+        # Отказ не занял время в бакете
+        with patch('weather_forecast.ratelimit.time.time', return_value=1001.0):
+            self.assertTrue(limiter.try_acquire())
+
+    @patch('weather_forecast.ratelimit.time.sleep')
+    @patch('weather_forecast.ratelimit.time.time', return_value=1000.0)
+    def test_acquire_waiters_get_slots_in_order(self, _, mock_sleep):
+        """ Ждущие в очереди получают слоты по порядку, каждый на period / rate позже предыдущего """
+
+        limiter = RateLimiter('example.com', rate=2, period=1, max_wait=5)
+
+        waits = [limiter.acquire() for _ in range(5)]
+
+        self.assertEqual(waits, [0.0, 0.0, 0.5, 1.0, 1.5])
+        self.assertEqual([call.args[0] for call in mock_sleep.call_args_list], [0.5, 1.0, 1.5])
+        metrics = limiter.get_metrics()
+        self.assertEqual((metrics['acquired'], metrics['queued'], metrics['queued_ms']), (5, 3, 3000))
+
+    def test_acquire_waits_for_slot(self):
+        """ Запрос действительно ждет свой слот """
+
+        limiter = RateLimiter('example.com', rate=1, period=0.05, max_wait=1)
+        limiter.acquire()
+
+        waited = limiter.acquire()
+
+        self.assertGreater(waited, 0)
+        metrics = limiter.get_metrics()
+        self.assertEqual(metrics['acquired'], 2)
+        self.assertEqual(metrics['queued'], 1)
+        self.assertEqual(metrics['rejected'], 0)
+
+    def test_limits_from_settings(self):
+        """ Параметры берутся из UPSTREAM_RATE_LIMITS, для неизвестного хоста - значения по умолчанию """
+
+        with override_settings(UPSTREAM_RATE_LIMITS={'example.com': {'rate': 7, 'period': 2, 'max_wait': 3}}):
+            limiter = get_rate_limiter('example.com')
+            self.assertEqual((limiter.rate, limiter.period, limiter.max_wait), (7, 2, 3))
+            self.assertEqual(get_rate_limiter('unknown.com').rate, 5)
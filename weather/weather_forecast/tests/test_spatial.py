@@ -0,0 +1,110 @@
+import unittest
+
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import override_settings
+
+from ..spatial import GridIndex, haversine_km, record_lookup, get_snap_metrics
+
+
+class TestHaversine(unittest.TestCase):
+    def test_distance(self):
+        """ Расстояние Москва - Санкт-Петербург около 634 км """
+
+        self.assertAlmostEqual(haversine_km(55.7558, 37.6173, 59.9343, 30.3351), 634, delta=5)
+        self.assertEqual(haversine_km(10.0, 20.0, 10.0, 20.0), 0)
+
+
+class TestGridIndex(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.index = GridIndex(radius_km=2, timeout=60)
+
+    def test_find_nearby_point(self):
+        """ Точка в нескольких сотнях метров находит уже известную """
+
+        self.index.add(55.7558, 37.6173)
+
+        self.assertEqual(self.index.find(55.7590, 37.6200), [(55.7558, 37.6173)])
+
+    def test_far_point_not_found(self):
+        """ Точка дальше радиуса не совпадает """
+
+        self.index.add(55.7558, 37.6173)
+
+        self.assertEqual(self.index.find(55.80, 37.6173), [])
+
+    def test_find_across_cell_border(self):
+        """ Точки по разные стороны границы ячейки находят друг друга """
+
+        border = self.index.lat_step * 3000
+        self.index.add(border - 0.001, 37.0)
+
+        self.assertEqual(self.index.find(border + 0.001, 37.0), [(border - 0.001, 37.0)])
+
+    def test_find_ordered_by_distance(self):
+        """ Известные точки возвращаются от ближайшей к дальней """
+
+        self.index.add(55.7558, 37.6173)
+        self.index.add(55.7650, 37.6173)
+
+        self.assertEqual(self.index.find(55.7640, 37.6173), [(55.7650, 37.6173), (55.7558, 37.6173)])
+
+    def test_expired_points_skipped_and_pruned(self):
+        """ Точка с истекшим прогнозом не находится и удаляется из ячейки при следующем добавлении,
+            хотя добавление продлевает срок жизни самой ячейки
+        """
+
+        with patch('weather_forecast.spatial.time.time', return_value=1000.0):
+            self.index.add(55.7558, 37.6173)
+        with patch('weather_forecast.spatial.time.time', return_value=1050.0):
+            self.index.add(55.7560, 37.6173)
+        with patch('weather_forecast.spatial.time.time', return_value=1070.0):
+            self.assertEqual(self.index.find(55.7558, 37.6173), [(55.7560, 37.6173)])
+            self.index.add(55.7562, 37.6173)
+            cell = cache.get(self.index._own_cell_key(55.7558, 37.6173))
+
+        self.assertEqual([point[:2] for point in cell], [(55.7560, 37.6173), (55.7562, 37.6173)])
+
+    def test_discard(self):
+        """ Удаленная точка больше не находится, остальные точки ячейки остаются """
+
+        self.index.add(55.7558, 37.6173)
+        self.index.add(55.7560, 37.6173)
+
+        self.index.discard([(55.7558, 37.6173)])
+
+        self.assertEqual(self.index.find(55.7558, 37.6173), [(55.7560, 37.6173)])
+
+    def test_high_latitude(self):
+        """ На высоких широтах ячейка по долготе шире, соседняя точка все равно находится """
+
+        self.index.add(78.2232, 15.6267)
+
+        self.assertEqual(self.index.find(78.2232, 15.6900), [(78.2232, 15.6267)])
+
+    def test_zero_radius(self):
+        """ При нулевом радиусе индекс возвращает сами координаты """
+
+        index = GridIndex(radius_km=0, timeout=60)
+        index.add(55.7558, 37.6173)
+
+        self.assertEqual(index.find(55.7590, 37.6200), [(55.7590, 37.6200)])
+
+
+class TestSnapMetrics(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(WEATHER_SNAP_RADIUS_KM=3)
+    def test_metrics(self):
+        """ Учитываются точные попадания, попадания по соседней точке и промахи """
+
+        record_lookup((1.0, 2.0), (1.0, 2.0))
+        record_lookup((1.0, 2.0), (1.001, 2.0))
+        record_lookup((1.0, 2.0), None)
+        record_lookup((1.0, 2.0), None)
+
+        self.assertEqual(get_snap_metrics(), {'exact_hits': 1, 'nearby_hits': 1, 'misses': 2,
+                                              'hit_rate': 0.5, 'radius_km': 3})
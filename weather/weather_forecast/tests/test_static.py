@@ -0,0 +1,94 @@
+import gzip
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import SimpleTestCase, RequestFactory, override_settings
+
+from ..middleware import StaticFilesMiddleware, parse_accept_encoding
+
+
+class TestParseAcceptEncoding(SimpleTestCase):
+    def test_parse(self):
+        """ Разбор заголовка с весами, q=0 означает запрет кодировки """
+
+        self.assertEqual(parse_accept_encoding('gzip, deflate, br'), {'gzip', 'deflate', 'br'})
+        self.assertEqual(parse_accept_encoding('br;q=0, gzip;q=0.5'), {'gzip'})
+        self.assertEqual(parse_accept_encoding(''), set())
+
+
+class TestCollectedStaticFiles(SimpleTestCase):
+    """ Сборка статики с хэшами и сжатыми вариантами и их раздача через StaticFilesMiddleware """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.static_root = Path(tempfile.mkdtemp())
+        cls.addClassCleanup(shutil.rmtree, cls.static_root)
+        settings_override = override_settings(STATIC_ROOT=cls.static_root)
+        settings_override.enable()
+        cls.addClassCleanup(settings_override.disable)
+
+        # Статика админки не нужна для проверки и только замедляет сжатие
+        call_command('collectstatic', interactive=False, verbosity=0, ignore_patterns=['admin'])
+        cls.hashed_name = staticfiles_storage.stored_name('vendor/bootstrap/css/bootstrap.min.css')
+
+    def setUp(self):
+        self.middleware = StaticFilesMiddleware(lambda request: HttpResponse('fallback'))
+        self.factory = RequestFactory()
+
+    def get(self, name: str, accept_encoding: str = ''):
+        request = self.factory.get(f'/static/{name}', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return self.middleware(request)
+
+    def test_compressed_variants_created(self):
+        """ Для файла с хэшем созданы .gz и .br, и они распаковываются в исходный файл """
+
+        self.assertTrue((self.static_root / 'staticfiles.json').exists())
+        self.assertNotEqual(self.hashed_name, 'vendor/bootstrap/css/bootstrap.min.css')
+        path = self.static_root / self.hashed_name
+        self.assertTrue(Path(f'{path}.br').exists())
+        self.assertEqual(gzip.decompress(Path(f'{path}.gz').read_bytes()), path.read_bytes())
+
+    def test_serve_hashed_file_immutable(self):
+        """ Файл с хэшем кэшируется навсегда """
+
+        response = self.get(self.hashed_name)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_serve_unhashed_file_short_cache(self):
+        """ Файл без хэша в имени кэшируется ненадолго """
+
+        response = self.get('vendor/bootstrap/css/bootstrap.min.css')
+
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_accept_encoding_negotiation(self):
+        """ brotli предпочтительнее gzip, gzip используется, если brotli не принимается """
+
+        path = self.static_root / self.hashed_name
+
+        response = self.get(self.hashed_name, 'gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(int(response['Content-Length']), Path(f'{path}.br').stat().st_size)
+        response.close()
+
+        response = self.get(self.hashed_name, 'gzip, br;q=0')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), path.read_bytes())
+        response.close()
+
+    def test_unknown_file_passed_through(self):
+        """ Отсутствующий файл и выход за пределы STATIC_ROOT передаются дальше по цепочке """
+
+        self.assertEqual(self.get('missing.css').content, b'fallback')
+        self.assertEqual(self.get('../settings.py').content, b'fallback')
@@ -1,11 +1,40 @@
 import json
 import unittest
 
-from requests.exceptions import RequestException
+import numpy as np
+from django.core.cache import cache
+from django.test import override_settings
+from requests.exceptions import ConnectionError as RequestsConnectionError, RequestException
 from unittest.mock import Mock, patch
 
+from ..ratelimit import get_rate_limiter, RateLimitExceeded
+from ..spatial import get_grid_index
 from ..utils import (update_last_cities, get_last_cities_from_cookie,
-                     decrypt_user_id, encrypt_user_id, parse_coordinates)
+                     decrypt_user_id, encrypt_user_id, parse_coordinates,
+                     parse_variables, get_weather, get_daily_summary, request_api, WEATHER_VARIABLES, DEFAULT_VARIABLES,
+                     SERVICE_BUSY_ERROR, WEATHER_CACHE_TIMEOUT)
+
+
+def patch_http_cache(test_case) -> None:
+    """ Подменяет HTTP-кэш запросов к open-meteo, чтобы тесты не создавали файл .cache.sqlite """
+
+    patcher = patch('weather_forecast.utils.requests_cache.CachedSession')
+    patcher.start()
+    test_case.addCleanup(patcher.stop)
+
+
+def make_openmeteo_response(start: int = 1735689600, hours: int = 168):
+    """ Имитация ответа open-meteo: значение переменной с индексом i в час h равно i * 1000 + h """
+
+    hourly = Mock()
+    hourly.Time.return_value = start
+    hourly.TimeEnd.return_value = start + hours * 3600
+    hourly.Interval.return_value = 3600
+    hourly.Variables.side_effect = lambda index: Mock(
+        ValuesAsNumpy=Mock(return_value=np.arange(hours, dtype=np.float32) + index * 1000))
+    response = Mock()
+    response.Hourly.return_value = hourly
+    return response
 
 
 class TestUpdateLastCities(unittest.TestCase):
@@ -138,3 +167,204 @@ class TestParseCoordinates(unittest.TestCase):
         coordinates = parse_coordinates('Москва')
 
         self.assertIsNone(coordinates)
+
+    @patch('weather_forecast.utils.requests.get')
+    @patch('weather_forecast.ratelimit.RateLimiter.acquire', side_effect=RateLimitExceeded('Симуляция лимита'))
+    def test_parse_coordinates_rate_limited(self, _, mock_get):
+        """ Исчерпанный лимит запросов не выдается за ненайденный город """
+
+        with self.assertRaises(RateLimitExceeded):
+            parse_coordinates('Москва')
+        mock_get.assert_not_called()
+
+
+class TestRequestApi(unittest.TestCase):
+    @patch('weather_forecast.utils.parse_coordinates', side_effect=RateLimitExceeded('Симуляция лимита'))
+    def test_service_busy_on_geocoding(self, _):
+        """ При исчерпанном лимите пользователь получает отдельное сообщение, а не «город не найден» """
+
+        self.assertEqual(request_api('Москва'), {'error': SERVICE_BUSY_ERROR, 'data': None})
+
+    @patch('weather_forecast.utils.fetch_forecast', side_effect=RateLimitExceeded('Симуляция лимита'))
+    @patch('weather_forecast.utils.parse_coordinates', return_value=(55.75, 37.61))
+    def test_service_busy_on_forecast(self, *_):
+        """ Лимит запросов к open-meteo тоже дает отдельное сообщение """
+
+        self.assertEqual(request_api('Москва'), {'error': SERVICE_BUSY_ERROR, 'data': None})
+        self.assertEqual(request_api('Москва', summary=True), {'error': SERVICE_BUSY_ERROR, 'data': None})
+
+
+class TestParseVariables(unittest.TestCase):
+    def test_empty_selection(self):
+        """ Пустой выбор заменяется параметрами по умолчанию """
+
+        self.assertEqual(parse_variables(None), DEFAULT_VARIABLES)
+        self.assertEqual(parse_variables([]), DEFAULT_VARIABLES)
+
+    def test_unknown_variables_are_dropped(self):
+        """ Неизвестные параметры отбрасываются, порядок берется из реестра """
+
+        self.assertEqual(parse_variables(['pressure', 'unknown', 'temperature']), ['temperature', 'pressure'])
+        self.assertEqual(parse_variables(['unknown']), DEFAULT_VARIABLES)
+
+
+class TestGetWeather(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        patch_http_cache(self)
+
+    @patch('weather_forecast.utils.openmeteo_requests.Client')
+    def test_selected_variables_only(self, mock_client):
+        """ В прогнозе присутствуют только выбранные параметры """
+
+        mock_client.return_value.weather_api.return_value = [make_openmeteo_response()]
+
+        forecasts = get_weather(55.75, 37.61, ['pressure', 'temperature'])
+
+        self.assertEqual(len(forecasts), 7)
+        self.assertEqual(len(forecasts[0]['hourly_data']), 24)
+        first_hour = forecasts[0]['hourly_data'][0]
+        self.assertEqual(set(first_hour), {'time', 'temperature', 'pressure'})
+        pressure_index = list(WEATHER_VARIABLES).index('pressure')
+        self.assertEqual(first_hour['pressure'], pressure_index * 1000)
+        self.assertEqual(forecasts[1]['hourly_data'][0]['temperature'], 24)
+
+    @patch('weather_forecast.utils.openmeteo_requests.Client')
+    def test_one_upstream_call_for_different_selections(self, mock_client):
+        """ Разные наборы параметров для одной точки обслуживаются одним запросом к API """
+
+        mock_client.return_value.weather_api.return_value = [make_openmeteo_response()]
+
+        get_weather(55.75, 37.61)
+        get_weather(55.75, 37.61, ['precipitation', 'cloudcover'])
+
+        mock_client.return_value.weather_api.assert_called_once()
+        params = mock_client.return_value.weather_api.call_args.kwargs['params']
+        self.assertEqual(params['hourly'], [api_name for api_name, _ in WEATHER_VARIABLES.values()])
+
+    @patch('weather_forecast.utils.openmeteo_requests.Client')
+    def test_nearby_coordinates_share_forecast(self, mock_client):
+        """ Для точки в пределах WEATHER_SNAP_RADIUS_KM используется уже полученный прогноз """
+
+        mock_client.return_value.weather_api.return_value = [make_openmeteo_response()]
+
+        with override_settings(WEATHER_SNAP_RADIUS_KM=2):
+            first = get_weather(55.7558, 37.6173)
+            second = get_weather(55.7590, 37.6200)
+            third = get_weather(55.9000, 37.6173)
+
+        self.assertEqual(first, second)
+        self.assertIsNotNone(third)
+        self.assertEqual(mock_client.return_value.weather_api.call_count, 2)
+
+    @override_settings(WEATHER_SNAP_RADIUS_KM=2)
+    @patch('weather_forecast.utils.openmeteo_requests.Client')
+    def test_nearest_point_without_forecast_skipped(self, mock_client):
+        """ Если прогноз ближайшей точки ушел из кэша, берется следующая точка с прогнозом,
+            а точка без прогноза удаляется из индекса
+        """
+
+        mock_client.return_value.weather_api.return_value = [make_openmeteo_response()]
+        grid_index = get_grid_index(WEATHER_CACHE_TIMEOUT)
+        fresh = get_weather(55.7598, 37.6173)
+        # Точка в индексе, но ее прогноз вытеснен из кэша
+        grid_index.add(55.7558, 37.6173)
+
+        forecast = get_weather(55.7560, 37.6173)
+
+        self.assertEqual(forecast, fresh)
+        self.assertEqual(mock_client.return_value.weather_api.call_count, 1)
+        self.assertEqual(grid_index.find(55.7560, 37.6173), [(55.7598, 37.6173)])
+
+    @patch('weather_forecast.utils.openmeteo_requests.Client')
+    def test_upstream_error(self, mock_client):
+        """ Ошибка API возвращает None """
+
+        mock_client.return_value.weather_api.side_effect = Exception('Симуляция ошибки API')
+
+        self.assertIsNone(get_weather(55.75, 37.61))
+
+    @patch('weather_forecast.utils.time.sleep')
+    @patch('weather_forecast.utils.openmeteo_requests.Client')
+    def test_retry_takes_rate_limit_token(self, mock_client, _):
+        """ Каждый повтор после сетевой ошибки проходит через ограничитель частоты """
+
+        mock_client.return_value.weather_api.side_effect = [RequestsConnectionError('Симуляция обрыва'),
+                                                            [make_openmeteo_response()]]
+
+        self.assertIsNotNone(get_weather(55.75, 37.61))
+        self.assertEqual(mock_client.return_value.weather_api.call_count, 2)
+        self.assertEqual(get_rate_limiter('api.open-meteo.com').get_metrics()['acquired'], 2)
+
+    @patch('weather_forecast.utils.openmeteo_requests.Client')
+    def test_no_retry_for_client_errors(self, mock_client):
+        """ Ошибки, которые не исправятся повтором, не повторяются """
+
+        mock_client.return_value.weather_api.side_effect = Exception('Симуляция ошибки API')
+
+        get_weather(55.75, 37.61)
+
+        mock_client.return_value.weather_api.assert_called_once()
+
+
+class TestGetDailySummary(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        patch_http_cache(self)
+
+    @patch('weather_forecast.utils.openmeteo_requests.Client')
+    def test_daily_aggregates(self, mock_client):
+        """ Агрегаты по дням считаются по 24 часам каждого дня """
+
+        mock_client.return_value.weather_api.return_value = [make_openmeteo_response()]
+        humidity_offset = list(WEATHER_VARIABLES).index('humidity') * 1000
+        windspeed_offset = list(WEATHER_VARIABLES).index('windspeed') * 1000
+
+        summary = get_daily_summary(55.75, 37.61)
+
+        self.assertEqual(len(summary), 7)
+        self.assertEqual(summary[0]['date'], '2025-01-01')
+        self.assertEqual(summary[0]['weekday'], 'среда')
+        self.assertEqual(summary[0]['temperature_min'], 0)
+        self.assertEqual(summary[0]['temperature_max'], 23)
+        self.assertEqual(summary[0]['temperature_mean'], 11.5)
+        self.assertEqual(summary[1]['temperature_min'], 24)
+        self.assertEqual(summary[6]['windspeed_max'], windspeed_offset + 167)
+        self.assertEqual(summary[6]['humidity_mean'], humidity_offset + 155.5)
+
+    @patch('weather_forecast.utils.openmeteo_requests.Client')
+    def test_day_without_data(self, mock_client):
+        """ День, за который у open-meteo нет данных, дает None вместо NaN """
+
+        response = make_openmeteo_response()
+        variables = response.Hourly.return_value.Variables.side_effect
+
+        def variable(index):
+            values = variables(index).ValuesAsNumpy()
+            values[24:48] = np.nan
+            return Mock(ValuesAsNumpy=Mock(return_value=values))
+
+        response.Hourly.return_value.Variables.side_effect = variable
+        mock_client.return_value.weather_api.return_value = [response]
+
+        summary = get_daily_summary(55.75, 37.61)
+
+        self.assertEqual(summary[0]['temperature_max'], 23)
+        self.assertIsNone(summary[1]['temperature_min'])
+        self.assertIsNone(summary[1]['humidity_mean'])
+        json.dumps(summary, allow_nan=False)
+
+    @patch('weather_forecast.utils.openmeteo_requests.Client')
+    def test_matches_hourly_forecast(self, mock_client):
+        """ Сводка совпадает с агрегатами, посчитанными по почасовому прогнозу """
+
+        mock_client.return_value.weather_api.return_value = [make_openmeteo_response()]
+
+        summary = get_daily_summary(55.75, 37.61)
+        hourly = get_weather(55.75, 37.61)
+
+        for day_summary, day in zip(summary, hourly):
+            temperatures = [hour['temperature'] for hour in day['hourly_data']]
+            self.assertEqual(day_summary['date'], day['date'])
+            self.assertEqual(day_summary['temperature_max'], max(temperatures))
+            self.assertEqual(day_summary['windspeed_max'], max(hour['windspeed'] for hour in day['hourly_data']))
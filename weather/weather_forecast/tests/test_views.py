@@ -6,8 +6,9 @@ from django.urls import reverse
 from unittest.mock import patch
 
 from ..models import User, SearchHistory
-from ..views import city_search_count
-from ..utils import encrypt_user_id
+from ..views import city_search_count, rate_limit_stats
+from ..utils import encrypt_user_id, SERVICE_BUSY_ERROR
+from .test_forecast import make_forecast
 
 
 class TestSearchHistoryAPI(TestCase):
@@ -45,6 +46,20 @@ class TestSearchHistoryAPI(TestCase):
         self.assertEqual(len(data), 0)
 
 
+class TestRateLimitStatsAPI(TestCase):
+    """ Тесты для точки доступа к метрикам ограничителя запросов """
+
+    def test_get_rate_limit_stats(self):
+        """ Метрики возвращаются для каждого настроенного хоста """
+
+        response = self.client.get(reverse(rate_limit_stats))
+
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertIn('api.open-meteo.com', data)
+        self.assertEqual(set(data['api.open-meteo.com']), {'acquired', 'queued', 'queued_ms', 'rejected'})
+
+
 class HomeViewTest(TestCase):
     """ Тесты для view home """
 
@@ -133,3 +148,165 @@ class HomeViewTest(TestCase):
         self.assertNotIn('invalid city', response.context['last_cities'])
         self.assertFalse(SearchHistory.objects.filter(user=self.user, city_name='invalid city').exists())
         self.assertIn('user_id', response.cookies)
+
+
+class TestForecastAPI(TestCase):
+    """ Тесты для точки доступа к прогнозу """
+
+    summary = [{'date': '2025-01-01', 'weekday': 'среда', 'temperature_min': -7.0, 'temperature_max': -1.5,
+                'temperature_mean': -4.2, 'windspeed_max': 5.1, 'humidity_mean': 85.3}]
+    hourly = [{'date': '2025-01-01', 'weekday': 'среда', 'hourly_data': []},
+              {'date': '2025-01-02', 'weekday': 'четверг', 'hourly_data': []}]
+
+    def test_city_name_required(self):
+        """ Без city_name возвращается ошибка 400 """
+
+        response = self.client.get(reverse('forecast_api'))
+
+        self.assertEqual(response.status_code, 400)
+
+    @patch('weather_forecast.views.request_api')
+    def test_summary(self, mock_request_api):
+        """ summary=1 возвращает сводку по дням """
+
+        mock_request_api.return_value = {'error': None, 'data': self.summary}
+        response = self.client.get(reverse('forecast_api'), {'city_name': 'Москва', 'summary': '1'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['data'], self.summary)
+        mock_request_api.assert_called_once_with('Москва', ['temperature', 'humidity', 'windspeed'], True)
+
+    @patch('weather_forecast.views.request_api')
+    def test_hourly_for_one_day(self, mock_request_api):
+        """ Параметр date оставляет почасовой прогноз только за один день """
+
+        mock_request_api.return_value = {'error': None, 'data': self.hourly}
+        response = self.client.get(reverse('forecast_api'), {'city_name': 'Москва', 'date': '2025-01-02'})
+
+        data = json.loads(response.content)['data']
+        self.assertEqual([forecast['date'] for forecast in data], ['2025-01-02'])
+        mock_request_api.assert_called_once_with('Москва', ['temperature', 'humidity', 'windspeed'], False)
+
+    @patch('weather_forecast.views.request_api')
+    def test_service_busy(self, mock_request_api):
+        """ Исчерпанный лимит запросов к внешним ресурсам возвращает 503 """
+
+        mock_request_api.return_value = {'error': SERVICE_BUSY_ERROR, 'data': None}
+        response = self.client.get(reverse('forecast_api'), {'city_name': 'Москва'})
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(json.loads(response.content)['error'], SERVICE_BUSY_ERROR)
+
+    @patch('weather_forecast.views.request_api')
+    def test_home_summary_table(self, mock_request_api):
+        """ Главная страница в режиме сводки выводит одну компактную таблицу """
+
+        mock_request_api.return_value = {'error': None, 'data': self.summary}
+        response = self.client.get(reverse('home'), {'city_name': 'Москва', 'summary': 'on',
+                                                     'variables': ['pressure', 'temperature']})
+
+        self.assertTrue(response.context['summary'])
+        self.assertContains(response, 'Средняя влажность (%)')
+        self.assertContains(response, '85.3')
+        # Ссылка на почасовой прогноз за день сохраняет выбранные параметры
+        self.assertContains(response, '?city_name=%D0%9C%D0%BE%D1%81%D0%BA%D0%B2%D0%B0&amp;date=2025-01-01'
+                                      '&amp;variables=temperature&amp;variables=pressure')
+
+    @patch('weather_forecast.views.request_api')
+    def test_home_one_day(self, mock_request_api):
+        """ Параметр date выводит на странице только таблицу выбранного дня """
+
+        mock_request_api.return_value = {'error': None, 'data': make_forecast()}
+        response = self.client.get(reverse('home'), {'city_name': 'Москва', 'date': '2025-01-03',
+                                                     'variables': ['humidity']})
+
+        forecasts = response.context['forecasts']
+        self.assertEqual([day['date'] for day in forecasts], ['2025-01-03'])
+        self.assertEqual(forecasts[0]['hourly_data'][0]['humidity'], 98.0)
+        self.assertContains(response, '<tr>', count=25)
+        self.assertContains(response, 'Сводка на 7 дней')
+
+    @patch('weather_forecast.views.request_api')
+    def test_home_unknown_day(self, mock_request_api):
+        """ Дата вне прогноза дает сообщение об ошибке """
+
+        mock_request_api.return_value = {'error': None, 'data': make_forecast()}
+        response = self.client.get(reverse('home'), {'city_name': 'Москва', 'date': '2030-01-01'})
+
+        self.assertEqual(response.context['error_message'], 'Нет прогноза на выбранную дату')
+        self.assertIsNone(response.context['forecasts'])
+
+    @patch('weather_forecast.views.request_api')
+    def test_missing_values(self, mock_request_api):
+        """ Пропуски в данных отдаются как null в JSON и прочерком в таблице """
+
+        summary = [dict(self.summary[0], humidity_mean=None)]
+        mock_request_api.return_value = {'error': None, 'data': summary}
+
+        response = self.client.get(reverse('forecast_api'), {'city_name': 'Москва', 'summary': '1'})
+        self.assertIn('"humidity_mean": null', response.content.decode())
+
+        response = self.client.get(reverse('home'), {'city_name': 'Москва', 'summary': 'on'})
+        self.assertContains(response, '<td>—</td>', html=True)
+        self.assertNotContains(response, 'None')
+
+
+class HomeStreamViewTest(TestCase):
+    """ Тесты для потоковых вариантов главной страницы """
+
+    forecasts = [{'date': '2025-01-01', 'weekday': 'среда',
+                  'hourly_data': [{'time': '00:00', 'temperature': -5.5, 'humidity': 80.0, 'windspeed': 3.2}]}]
+
+    def setUp(self):
+        self.user = User.objects.create()
+        self.client.cookies['user_id'] = encrypt_user_id(str(self.user.user_id))
+
+    @patch('weather_forecast.views.request_api')
+    def test_header_sent_before_forecast(self, mock_request_api):
+        """ Шапка и форма отправляются до запроса к внешним ресурсам """
+
+        mock_request_api.return_value = {'error': None, 'data': self.forecasts}
+        response = self.client.get(reverse('home_stream'), {'city_name': 'Москва'})
+
+        self.assertTrue(response.streaming)
+        chunks = iter(response.streaming_content)
+        first_chunk = next(chunks).decode()
+        self.assertIn('<form method="post" action="/stream/">', first_chunk)
+        mock_request_api.assert_not_called()
+
+        rest = b''.join(chunks).decode()
+        mock_request_api.assert_called_once()
+        self.assertIn('Прогноз погоды на 7 дней в Москва', rest)
+        self.assertIn('-5.5', rest)
+        self.assertIn('document.cookie = "last_cities=', rest)
+        self.assertTrue(rest.rstrip().endswith('</html>'))
+        self.assertTrue(SearchHistory.objects.filter(user=self.user, city_name='Москва').exists())
+        self.assertIn('user_id', response.cookies)
+        self.assertIn('last_cities', response.cookies)
+
+    @patch('weather_forecast.views.request_api')
+    def test_stream_error(self, mock_request_api):
+        """ При ошибке вместо таблиц отправляется сообщение, история и last_cities не меняются """
+
+        mock_request_api.return_value = {'error': 'Не удалось найти информацию о погоде в заданном городе',
+                                         'data': None}
+        response = self.client.get(reverse('home_stream'), {'city_name': 'invalid city'})
+
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn('Не удалось найти информацию о погоде в заданном городе', content)
+        self.assertNotIn('document.cookie', content)
+        self.assertFalse(SearchHistory.objects.filter(user=self.user, city_name='invalid city').exists())
+
+    @patch('weather_forecast.views.request_api')
+    async def test_async_stream(self, mock_request_api):
+        """ Асинхронный вариант отдает ту же страницу """
+
+        mock_request_api.return_value = {'error': None, 'data': self.forecasts}
+        self.async_client.cookies['user_id'] = self.client.cookies['user_id'].value
+        response = await self.async_client.post(reverse('home_stream_async'), {'city_name': 'Москва'})
+
+        content = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertIn('Прогноз погоды на 7 дней в Москва', content)
+        self.assertIn('document.cookie = "last_cities=', content)
+        self.assertTrue(await SearchHistory.objects.filter(user=self.user, city_name='Москва').aexists())
+        self.assertIn('user_id', response.cookies)
@@ -7,32 +7,64 @@ import base64
 import json
 import logging
 import os
+import time
+import warnings
+import numpy as np
 import openmeteo_requests
-import pandas as pd
 import requests
 import requests_cache
 import urllib
 
-from babel.dates import format_date
 from bs4 import BeautifulSoup
 from cryptography.fernet import Fernet
+from django.core.cache import cache
 from dotenv import load_dotenv
-from retry_requests import retry
 
+from .forecast import Forecast, rounded_list
+from .ratelimit import get_rate_limiter, RateLimitExceeded
+from .spatial import get_grid_index, record_lookup
 
 load_dotenv()
 ENCRYPTION_KEY = os.environ.get('ENCRYPTION_KEY')
 
+# Реестр доступных параметров погоды: ключ -> (имя переменной в open-meteo, заголовок столбца).
+# К API всегда запрашивается весь реестр целиком, поэтому порядок важен:
+# по нему open-meteo возвращает переменные в ответе
+WEATHER_VARIABLES = {
+    'temperature': ('temperature_2m', 'Температура (°C)'),
+    'apparent_temperature': ('apparent_temperature', 'Ощущается как (°C)'),
+    'humidity': ('relativehumidity_2m', 'Влажность (%)'),
+    'windspeed': ('windspeed_10m', 'Скорость ветра (м/с)'),
+    'windgusts': ('windgusts_10m', 'Порывы ветра (м/с)'),
+    'precipitation': ('precipitation', 'Осадки (мм)'),
+    'precipitation_probability': ('precipitation_probability', 'Вероятность осадков (%)'),
+    'pressure': ('pressure_msl', 'Давление (гПа)'),
+    'cloudcover': ('cloudcover', 'Облачность (%)'),
+}
+DEFAULT_VARIABLES = ['temperature', 'humidity', 'windspeed']
+
+WEATHER_CACHE_TIMEOUT = 60 * 60  # 1 час, как и у requests_cache
+
+CITY_NOT_FOUND_ERROR = 'Не удалось найти информацию о погоде в заданном городе'
+SERVICE_BUSY_ERROR = 'Сервис перегружен запросами, попробуйте позже'
+
+OPENMETEO_URL = 'https://api.open-meteo.com/v1/forecast'
+# Повторы запроса к open-meteo при сетевых ошибках и ответах 5xx, каждый повтор проходит через ограничитель
+OPENMETEO_RETRIES = 2
+OPENMETEO_BACKOFF = 0.5  # Пауза перед повтором в секундах, удваивается с каждой попыткой
+
 
 def parse_coordinates(city_name: str) -> tuple | None:
     """ Берет координаты со страницы города в википедии.
         Возвращает кортеж координат при удачном получении.
-        Возвращает None при ошибке
+        Возвращает None при ошибке.
+        RateLimitExceeded пробрасывается: город может существовать, просто лимит запросов исчерпан
     """
 
     try:
         encoded_city_name = urllib.parse.quote(city_name)
         url = f'https://ru.wikipedia.org/wiki/{encoded_city_name}'
+        get_rate_limiter('ru.wikipedia.org').acquire()
         response = requests.get(url)
         response.raise_for_status()
         soup = BeautifulSoup(response.content, 'html.parser')
@@ -54,93 +86,212 @@ def parse_coordinates(city_name: str) -> tuple | None:
         else:
             logging.error(f'Не удалось найти координаты на странице')
 
+    except RateLimitExceeded:
+        raise
     except requests.exceptions.RequestException as e:
         logging.error(f'Ошибка при запросе: {e}')
     except Exception as e:
         logging.error(f'Ошибка при парсинге: {e}')
 
 
-def get_weather(latitude: float, longitude: float) -> list | None:
+def parse_variables(variables: list | None) -> list:
+    """ Отбирает из списка, пришедшего от пользователя, известные параметры погоды.
+        Порядок берется из реестра, а не из запроса, чтобы столбцы таблицы не прыгали.
+        Возвращает параметры по умолчанию, если ничего не выбрано
+    """
+
+    if variables:
+        selected = [key for key in WEATHER_VARIABLES if key in variables]
+        if selected:
+            return selected
+    return list(DEFAULT_VARIABLES)
+
+
+def get_weather_cache_key(latitude: float, longitude: float) -> str:
+    """ Ключ кэша прогноза для точных координат """
+
+    return f'weather:forecast:{latitude:.4f}:{longitude:.4f}'
+
+
+def fetch_forecast(latitude: float, longitude: float) -> Forecast:
+    """ Запрашивает у open-meteo почасовой прогноз на 7 дней сразу по всем параметрам реестра.
+        Результат хранится в кэше по координатам в виде Forecast,
+        поэтому любой набор параметров для одной точки обслуживается одним запросом к API.
+        Для точки в пределах WEATHER_SNAP_RADIUS_KM от уже закэшированной используется ее прогноз.
+        Исключения пробрасываются вызывающему коду
+    """
+
+    return fetch_forecasts_batch([(latitude, longitude)])[0]
+
+
+def is_retryable(error: Exception) -> bool:
+    """ Сетевая ошибка или ответ 5xx, после которых имеет смысл повторить запрос """
+
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500
+    return False
+
+
+def request_openmeteo(params: dict, tokens: int = 1) -> list:
+    """ Запрос прогноза к open-meteo с повторами при временных ошибках.
+        Перед каждой попыткой, включая повторы, забираются tokens токенов ограничителя частоты,
+        поэтому повторы не добавляют нагрузки сверх лимита, когда API и так не справляется.
+        Поднимает RateLimitExceeded, если слот не освободился, и исключение последней попытки
+    """
+
+    cache_session = requests_cache.CachedSession('.cache', expire_after=3600)
+    openmeteo = openmeteo_requests.Client(session=cache_session)
+    limiter = get_rate_limiter('api.open-meteo.com')
+
+    for attempt in range(OPENMETEO_RETRIES + 1):
+        limiter.acquire(tokens)
+        try:
+            return openmeteo.weather_api(OPENMETEO_URL, params=params)
+        except Exception as e:
+            if attempt == OPENMETEO_RETRIES or not is_retryable(e):
+                raise
+            logging.warning(f'Ошибка при запросе к open-meteo, повтор {attempt + 1}: {e}')
+            time.sleep(OPENMETEO_BACKOFF * 2 ** attempt)
+
+
+def fetch_forecasts_batch(coordinates: list) -> list:
+    """ То же, что fetch_forecast, для списка точек [(широта, долгота), ...].
+        Все точки, которых нет в кэше, запрашиваются у open-meteo одним запросом.
+        Возвращает прогнозы в том же порядке, что и координаты
+    """
+
+    grid_index = get_grid_index(WEATHER_CACHE_TIMEOUT)
+    results = [None] * len(coordinates)
+    missing = []
+    for position, (latitude, longitude) in enumerate(coordinates):
+        candidates = grid_index.find(latitude, longitude)
+        cached = cache.get_many([get_weather_cache_key(*point) for point in candidates])
+        # Берется ближайшая точка, чей прогноз еще в кэше, точки без прогноза удаляются из индекса
+        alive = [point for point in candidates if get_weather_cache_key(*point) in cached]
+        if len(alive) < len(candidates):
+            grid_index.discard([point for point in candidates if point not in alive])
+        found = alive[0] if alive else None
+        record_lookup((latitude, longitude), found)
+        if found is None:
+            missing.append(position)
+        else:
+            results[position] = cached[get_weather_cache_key(*found)]
+
+    if not missing:
+        return results
+
+    params = {
+        'latitude': [coordinates[position][0] for position in missing],
+        'longitude': [coordinates[position][1] for position in missing],
+        'hourly': [api_name for api_name, _ in WEATHER_VARIABLES.values()],
+        'forecast_days': 7  # Запрашиваем прогноз на 7 дней
+    }
+    # open-meteo учитывает в квоте каждую точку запроса, поэтому токенов забирается по числу точек
+    responses = request_openmeteo(params, tokens=len(missing))
+
+    # open-meteo возвращает ответы в порядке переданных координат
+    for position, response in zip(missing, responses):
+        latitude, longitude = coordinates[position]
+        hourly = response.Hourly()
+        forecast = Forecast.from_arrays(hourly.Time(), hourly.Interval(),
+                                        {key: hourly.Variables(index).ValuesAsNumpy()
+                                         for index, key in enumerate(WEATHER_VARIABLES)})
+        cache.set(get_weather_cache_key(latitude, longitude), forecast, WEATHER_CACHE_TIMEOUT)
+        grid_index.add(latitude, longitude)
+        results[position] = forecast
+    return results
+
+
+def get_weather(latitude: float, longitude: float, variables: list | None = None) -> Forecast | None:
     """ Запрашивает прогноз погоды на 7 дней по координатам.
-        Возвращает список из словарей, где каждый словарь - это прогноз на 1 день
-        Возвращает None при ошибках
+        variables - ключи из WEATHER_VARIABLES, по умолчанию температура, влажность и скорость ветра.
+        Возвращает Forecast - последовательность дней, каждый день читается как словарь
+        с ключами date, weekday и hourly_data (см. forecast.py)
+        Возвращает None при ошибках, RateLimitExceeded пробрасывается
     """
 
     try:
-        # Настройка повторных попыток запроса при ошибках
-        cache_session = requests_cache.CachedSession('.cache', expire_after=3600)
-        retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
-        openmeteo = openmeteo_requests.Client(session=retry_session)
-
-        url = 'https://api.open-meteo.com/v1/forecast'
-        params = {
-            'latitude': latitude,
-            'longitude': longitude,
-            # Запрос на температуру, влажность и скорость ветра на 7 дней
-            'hourly': ['temperature_2m', 'relativehumidity_2m', 'windspeed_10m'],
-            'forecast_days': 7  # Запрашиваем прогноз на 7 дней
-        }
-        response = openmeteo.weather_api(url, params=params)[0]
+        # Из закэшированного набора берутся только выбранные пользователем параметры
+        return fetch_forecast(latitude, longitude).select(parse_variables(variables))
 
-        hourly = response.Hourly()
+    except RateLimitExceeded:
+        raise
+    except Exception as e:
+        logging.error(f'Ошибка при получении погоды по координатам: {e}')
 
-        hourly_temperature_2m = hourly.Variables(0).ValuesAsNumpy()
-        hourly_relativehumidity_2m = hourly.Variables(1).ValuesAsNumpy()
-        hourly_windspeed_10m = hourly.Variables(2).ValuesAsNumpy()
-        hourly_times = pd.date_range(
-            start=pd.to_datetime(hourly.Time(), unit='s', utc=True),
-            end=pd.to_datetime(hourly.TimeEnd(), unit='s', utc=True),
-            freq=pd.Timedelta(seconds=hourly.Interval()),
-            inclusive='left'
-        )
-
-        hourly_data = {'date': hourly_times,
-                       'temperature_2m': hourly_temperature_2m,
-                       'relativehumidity_2m': hourly_relativehumidity_2m,
-                       'windspeed_10m': hourly_windspeed_10m}
-
-        hourly_dataframe = pd.DataFrame(data=hourly_data)
-
-        daily_forecasts = []
-        for i in range(7):
-            day_data = hourly_dataframe[hourly_dataframe['date'].dt.day == hourly_dataframe['date'].dt.day.unique()[i]]
-            hourly_forecasts = []
-            for index, row in day_data.iterrows():
-                hourly_forecast = {
-                    'time': row['date'].strftime('%H:%M'),
-                    'temperature': round(row['temperature_2m'], 1),
-                    'humidity': round(row['relativehumidity_2m'], 1),
-                    'windspeed': round(row['windspeed_10m'], 1),
-                }
-                hourly_forecasts.append(hourly_forecast)
-
-            weekday = format_date(day_data['date'].iloc[0], format='EEEE', locale='ru')  # day_data['date'].iloc[0].strftime('%A')
-            weather_data = {
-                'date': day_data['date'].iloc[0].strftime('%Y-%m-%d'),
-                'weekday': weekday,
-                'hourly_data': hourly_forecasts,
+
+def get_daily_summary(latitude: float, longitude: float) -> list | None:
+    """ Сводка по дням на 7 дней: минимальная, максимальная и средняя температура,
+        максимальная скорость ветра и средняя влажность.
+        Считается по закэшированному прогнозу: массив режется на строки по дням (reshape)
+        и сворачивается по оси часов без циклов по значениям.
+        Значение за день, в котором у open-meteo нет данных ни за один час, - None.
+        Возвращает список из 7 словарей или None при ошибках, RateLimitExceeded пробрасывается
+    """
+
+    try:
+        forecast = fetch_forecast(latitude, longitude)
+        days, hours_per_day = len(forecast), forecast.hours_per_day
+
+        def by_day(key: str) -> np.ndarray:
+            values = forecast.column(key)[:days * hours_per_day].astype(np.float64)
+            return values.reshape(days, hours_per_day)
+
+        temperature = by_day('temperature')
+        # Для дня целиком из NaN nan-функции дают NaN с предупреждением, он заменяется на None ниже
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            aggregates = {
+                'temperature_min': np.nanmin(temperature, axis=1),
+                'temperature_max': np.nanmax(temperature, axis=1),
+                'temperature_mean': np.nanmean(temperature, axis=1),
+                'windspeed_max': np.nanmax(by_day('windspeed'), axis=1),
+                'humidity_mean': np.nanmean(by_day('humidity'), axis=1),
             }
-            daily_forecasts.append(weather_data)
-        return daily_forecasts
+        aggregates = {key: rounded_list(values) for key, values in aggregates.items()}
 
+        daily_summary = []
+        for day, day_view in enumerate(forecast):
+            day_summary = {
+                'date': day_view['date'],
+                'weekday': day_view['weekday'],
+            }
+            for key, values in aggregates.items():
+                day_summary[key] = values[day]
+            daily_summary.append(day_summary)
+        return daily_summary
+
+    except RateLimitExceeded:
+        raise
     except Exception as e:
-        logging.error(f'Ошибка при получении погоды по координатам: {e}')
+        logging.error(f'Ошибка при получении сводки погоды по координатам: {e}')
 
 
-def request_api(city_name: str) -> dict:
+def request_api(city_name: str, variables: list | None = None, summary: bool = False) -> dict:
     """ Объединение всей логики получения информации для вызова из view.
+        При summary=True вместо почасового прогноза возвращается сводка по дням.
         Возвращает словарь, который содержит текст ошибки,
-        если получены данные о погоде, то передает их по ключу 'data'
+        если получены данные о погоде, то передает их по ключу 'data'.
+        Если исчерпан лимит запросов к внешним ресурсам, возвращается SERVICE_BUSY_ERROR
     """
 
-    answer = parse_coordinates(city_name)
-    if answer:
-        latitude, longitude = answer
-        data = get_weather(latitude, longitude)
-        return {'data': data,
-                'error': None}
-    else:
-        return {'error': 'Не удалось найти информацию о погоде в заданном городе',
+    try:
+        answer = parse_coordinates(city_name)
+        if answer:
+            latitude, longitude = answer
+            if summary:
+                data = get_daily_summary(latitude, longitude)
+            else:
+                data = get_weather(latitude, longitude, variables)
+            return {'data': data,
+                    'error': None}
+        else:
+            return {'error': CITY_NOT_FOUND_ERROR,
+                    'data': None}
+    except RateLimitExceeded:
+        return {'error': SERVICE_BUSY_ERROR,
                 'data': None}
 
 
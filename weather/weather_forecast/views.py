@@ -1,24 +1,29 @@
 import json
 import logging
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
 
 import requests
+from asgiref.sync import sync_to_async
 from django.db.models import Count
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.template.loader import render_to_string
 
+from .forecast import Forecast
 from .models import User, SearchHistory
-from .utils import request_api, encrypt_user_id, decrypt_user_id, get_last_cities_from_cookie, update_last_cities
+from .ratelimit import get_rate_limit_metrics
+from .spatial import get_snap_metrics
+from .utils import (request_api, encrypt_user_id, decrypt_user_id, get_last_cities_from_cookie, update_last_cities,
+                    parse_variables, WEATHER_VARIABLES, SERVICE_BUSY_ERROR)
 
 
-def home(request):
-    """
-    Главная страница приложения.
-    Обрабатывает GET запрос с параметрами и POST запрос для работы с формой.
-    """
+LAST_CITIES_MAX_AGE = 60 * 60 * 24 * 7  # 1 неделя
+USER_ID_MAX_AGE = 60 * 60 * 24 * 30 * 6  # 6 месяцев
 
-    last_cities = get_last_cities_from_cookie(request)
-    forecasts = None
-    error_message = None
+
+def get_or_create_user(request) -> User:
+    """ Находит пользователя по зашифрованному user_id из куков или создает нового """
 
     encrypted_user_id = request.COOKIES.get('user_id')
 
@@ -26,55 +31,210 @@ def home(request):
         user_id = decrypt_user_id(str(encrypted_user_id))
         if user_id:
             try:
-                user = User.objects.get(user_id=user_id)
+                return User.objects.get(user_id=user_id)
             except User.DoesNotExist:
-                user = User.objects.create()
-        else:
-            user = User.objects.create()
-    else:
-        user = User.objects.create()
+                pass
+    return User.objects.create()
+
+
+async def aget_or_create_user(request) -> User:
+    """ Асинхронный вариант get_or_create_user """
+
+    encrypted_user_id = request.COOKIES.get('user_id')
+
+    if encrypted_user_id:
+        user_id = decrypt_user_id(str(encrypted_user_id))
+        if user_id:
+            try:
+                return await User.objects.aget(user_id=user_id)
+            except User.DoesNotExist:
+                pass
+    return await User.objects.acreate()
+
+
+def parse_flag(value: str | None) -> bool:
+    """ Флаг из параметра запроса: 1, true, on """
+
+    return (value or '').lower() in ('1', 'true', 'on')
+
+
+def get_query(request) -> tuple:
+    """ Название города, выбранные параметры погоды, режим сводки по дням
+        и день почасового прогноза (ГГГГ-ММ-ДД) из GET или POST запроса
+    """
 
     if request.method == 'POST':
-        city_name_from_user = request.POST.get('city_name')
+        data = request.POST
     elif request.method == 'GET':
-        city_name_from_user = request.GET.get('city_name')
+        data = request.GET
     else:
-        city_name_from_user = None
+        return None, parse_variables(None), False, None
+    return (data.get('city_name'), parse_variables(data.getlist('variables')), parse_flag(data.get('summary')),
+            data.get('date') or None)
 
-    if city_name_from_user:
-        forecasts_answer = request_api(city_name_from_user)
-        if forecasts_answer:
-            error_message = forecasts_answer['error']
-            forecasts = forecasts_answer['data']
 
-            if error_message is None:
-                SearchHistory.objects.create(user=user, city_name=city_name_from_user)
-                last_cities = update_last_cities(last_cities, city_name_from_user)
+def select_day(forecasts_answer: dict | None, date: str | None) -> dict | None:
+    """ Оставляет в ответе request_api прогноз только за один день.
+        Остальные дни не выводятся в шаблон и не превращаются в словари для JSON
+    """
 
-        else:
-            logging.error(f'Ошибка при запросе к API')
+    if not date or not forecasts_answer or not forecasts_answer['data']:
+        return forecasts_answer
 
-    context = {
+    data = forecasts_answer['data']
+    if isinstance(data, Forecast):
+        data = data.for_date(date)
+    else:
+        data = [forecast for forecast in data if forecast['date'] == date] or None
+    if data is None:
+        return {'error': 'Нет прогноза на выбранную дату', 'data': None}
+    return {'error': None, 'data': data}
+
+
+def get_home_context(request, last_cities: list, city_name_from_user: str | None, variables: list,
+                     summary: bool, date: str | None) -> dict:
+    """ Контекст шаблона главной страницы без прогноза """
+
+    return {
         'message': 'Приветствуем! Введите название города, чтобы увидеть прогноз погоды.',
         'city_name': '',
         'last_cities': last_cities,
-        'forecasts': forecasts,
-        'error_message': error_message,
+        'forecasts': None,
+        'error_message': None,
         'city_name_for_template': city_name_from_user or '',
+        'variables': [(key, WEATHER_VARIABLES[key][1]) for key in variables],
+        'available_variables': [(key, label) for key, (_, label) in WEATHER_VARIABLES.items()],
+        'selected_variables': variables,
+        # Выбранные параметры для ссылок на почасовой прогноз за день и обратно на сводку
+        'variables_query': urlencode([('variables', key) for key in variables]),
+        'summary': summary,
+        'date': date,
+        'form_url': request.path,
     }
 
-    response = render(request, 'home.html', context)
 
-    # Обновление куков у пользователя
+def set_user_cookies(response, user: User, last_cities: list, city_name_from_user: str | None) -> None:
+    """ Обновление куков у пользователя """
+
     if city_name_from_user:
         last_cities_json = json.dumps(last_cities)
-        response.set_cookie('last_cities', last_cities_json, max_age=60 * 60 * 24 * 7)
+        response.set_cookie('last_cities', last_cities_json, max_age=LAST_CITIES_MAX_AGE)
 
     if user:
-        expires_in_seconds = 60 * 60 * 24 * 30 * 6  # 6 месяцев
         encrypted_user_id = encrypt_user_id(str(user.user_id))
-        response.set_cookie('user_id', encrypted_user_id, max_age=expires_in_seconds, httponly=True)
+        response.set_cookie('user_id', encrypted_user_id, max_age=USER_ID_MAX_AGE, httponly=True)
+
+
+def home(request):
+    """
+    Главная страница приложения.
+    Обрабатывает GET запрос с параметрами и POST запрос для работы с формой.
+    """
+
+    last_cities = get_last_cities_from_cookie(request)
+    user = get_or_create_user(request)
+    city_name_from_user, variables, summary, date = get_query(request)
+    context = get_home_context(request, last_cities, city_name_from_user, variables, summary, date)
+
+    if city_name_from_user:
+        forecasts_answer = select_day(request_api(city_name_from_user, variables, summary), date)
+        if forecasts_answer:
+            context['error_message'] = forecasts_answer['error']
+            context['forecasts'] = forecasts_answer['data']
 
+            if context['error_message'] is None:
+                SearchHistory.objects.create(user=user, city_name=city_name_from_user)
+                last_cities = update_last_cities(last_cities, city_name_from_user)
+                context['last_cities'] = last_cities
+
+        else:
+            logging.error(f'Ошибка при запросе к API')
+
+    response = render(request, 'home.html', context)
+    set_user_cookies(response, user, last_cities, city_name_from_user)
+    return response
+
+
+def render_forecasts_chunk(request, context: dict, forecasts_answer: dict | None) -> tuple:
+    """ Часть потоковой страницы после получения прогноза: таблицы или ошибка.
+        Возвращает (html, успешен ли запрос)
+    """
+
+    if forecasts_answer:
+        context['error_message'] = forecasts_answer['error']
+        context['forecasts'] = forecasts_answer['data']
+    else:
+        logging.error(f'Ошибка при запросе к API')
+
+    html = render_to_string('home_forecasts.html', context, request)
+    return html, bool(forecasts_answer) and context['error_message'] is None
+
+
+def render_last_cities_cookie(last_cities: list) -> str:
+    """ Скрипт, обновляющий куки last_cities: в потоковом режиме заголовки уже отправлены """
+
+    cookie = SimpleCookie()
+    cookie['last_cities'] = json.dumps(last_cities)
+    return render_to_string('home_last_cities_cookie.html', {'cookie_value': cookie['last_cities'].coded_value,
+                                                             'max_age': LAST_CITIES_MAX_AGE})
+
+
+def home_stream(request):
+    """
+    Потоковый вариант главной страницы.
+    Шапка, последние города и форма отправляются сразу, таблицы прогноза или ошибка - по мере получения данных.
+    Куки user_id и текущий список last_cities уходят в заголовках,
+    новый список last_cities после успешного запроса выставляется скриптом в конце страницы.
+    """
+
+    last_cities = get_last_cities_from_cookie(request)
+    user = get_or_create_user(request)
+    city_name_from_user, variables, summary, date = get_query(request)
+    context = get_home_context(request, last_cities, city_name_from_user, variables, summary, date)
+    header = render_to_string('home_header.html', context, request)
+
+    def stream():
+        yield header
+        if city_name_from_user:
+            forecasts_answer = select_day(request_api(city_name_from_user, variables, summary), date)
+            html, success = render_forecasts_chunk(request, context, forecasts_answer)
+            yield html
+            if success:
+                SearchHistory.objects.create(user=user, city_name=city_name_from_user)
+                yield render_last_cities_cookie(update_last_cities(last_cities, city_name_from_user))
+        yield render_to_string('home_footer.html')
+
+    response = StreamingHttpResponse(stream())
+    set_user_cookies(response, user, last_cities, city_name_from_user)
+    return response
+
+
+async def home_stream_async(request):
+    """
+    Асинхронный вариант home_stream для запуска под ASGI.
+    Запросы к внешним ресурсам выполняются в потоке, не блокируя цикл событий.
+    """
+
+    last_cities = get_last_cities_from_cookie(request)
+    user = await aget_or_create_user(request)
+    city_name_from_user, variables, summary, date = get_query(request)
+    context = get_home_context(request, last_cities, city_name_from_user, variables, summary, date)
+    header = render_to_string('home_header.html', context, request)
+
+    async def stream():
+        yield header
+        if city_name_from_user:
+            forecasts_answer = await sync_to_async(request_api)(city_name_from_user, variables, summary)
+            forecasts_answer = select_day(forecasts_answer, date)
+            html, success = render_forecasts_chunk(request, context, forecasts_answer)
+            yield html
+            if success:
+                await SearchHistory.objects.acreate(user=user, city_name=city_name_from_user)
+                yield render_last_cities_cookie(update_last_cities(last_cities, city_name_from_user))
+        yield render_to_string('home_footer.html')
+
+    response = StreamingHttpResponse(stream())
+    set_user_cookies(response, user, last_cities, city_name_from_user)
     return response
 
 
@@ -85,3 +245,39 @@ def city_search_count(_: requests.request):
     city_counts_list = list(city_counts)
     json_data = json.dumps(city_counts_list, ensure_ascii=False)
     return HttpResponse(json_data, content_type='application/json')
+
+
+def rate_limit_stats(_: requests.request):
+    """ Точка доступа к API для получения метрик ограничителя частоты запросов к внешним ресурсам """
+
+    json_data = json.dumps(get_rate_limit_metrics(), ensure_ascii=False)
+    return HttpResponse(json_data, content_type='application/json')
+
+
+def weather_cache_stats(_: requests.request):
+    """ Точка доступа к API для получения статистики попаданий в кэш прогнозов по близким координатам """
+
+    json_data = json.dumps(get_snap_metrics(), ensure_ascii=False)
+    return HttpResponse(json_data, content_type='application/json')
+
+
+def forecast_api(request):
+    """ Точка доступа к API для получения прогноза по названию города.
+        Параметры: city_name, summary=1 - сводка по дням вместо почасового прогноза,
+        variables - параметры почасового прогноза, date - почасовой прогноз только за один день
+    """
+
+    city_name, variables, summary, date = get_query(request)
+    if not city_name:
+        json_data = json.dumps({'error': 'Не указан параметр city_name', 'data': None}, ensure_ascii=False)
+        return HttpResponse(json_data, content_type='application/json', status=400)
+
+    forecasts_answer = select_day(request_api(city_name, variables, summary), date)
+    if isinstance(forecasts_answer['data'], Forecast):
+        forecasts_answer['data'] = forecasts_answer['data'].to_list()
+
+    # Исчерпан лимит запросов к внешним ресурсам: клиент может повторить запрос позже
+    status = 503 if forecasts_answer['error'] == SERVICE_BUSY_ERROR else 200
+    # Пропуски в данных приходят как None, NaN в ответе был бы невалидным JSON
+    json_data = json.dumps(forecasts_answer, ensure_ascii=False, allow_nan=False)
+    return HttpResponse(json_data, content_type='application/json', status=status)